@@ -0,0 +1,135 @@
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This Ansible plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this plugin.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Profile playbook run: wall time per task and role, loop item counts per host
+and AWS API calls reported by gaia modules (see module_utils/gaia_aws.py).
+
+At the end of the run a JSON profile is written and a top-N summary printed.
+Environment variables:
+  PROFILE_STAGES_OUTPUT - JSON profile path (default: .ansible-profile.json)
+  PROFILE_STAGES_TOP    - number of entries in summary (default: 20)
+'''
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+from time import time
+
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'profile_stages'
+    CALLBACK_NEEDS_WHITELIST = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.output = os.environ.get('PROFILE_STAGES_OUTPUT', '.ansible-profile.json')
+        self.top = int(os.environ.get('PROFILE_STAGES_TOP', 20))
+        self.start = time()
+        self.tasks = []
+        self.current = None
+        self.aws = {}
+
+    def _end_task(self):
+        if self.current is not None:
+            self.current['seconds'] = round(time() - self.current.pop('_start'), 3)
+            self.tasks.append(self.current)
+            self.current = None
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._end_task()
+        self.current = {
+            'task': task.get_name(),
+            'role': task._role.get_name() if task._role else None,
+            'items': {},
+            '_start': time(),
+        }
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self.v2_playbook_on_task_start(task, False)
+
+    def _add_aws_calls(self, result):
+        for service, stats in (result.get('aws_api_calls') or {}).items():
+            total = self.aws.setdefault(service, {'count': 0, 'seconds': 0.0, 'retries': 0, 'throttled': 0,
+                                                  'operations': {}})
+            total['count'] += stats['count']
+            total['seconds'] += stats['seconds']
+            total['retries'] += stats.get('retries', 0)
+            total['throttled'] += stats.get('throttled', 0)
+            for operation, count in stats['operations'].items():
+                total['operations'][operation] = total['operations'].get(operation, 0) + count
+
+    def _on_result(self, result):
+        res = result._result
+        # loop results carry per item module output
+        for item in res.get('results', []) if isinstance(res.get('results'), list) else []:
+            if isinstance(item, dict):
+                self._add_aws_calls(item)
+        self._add_aws_calls(res)
+
+    def _on_item(self, result):
+        if self.current is not None:
+            host = result._host.get_name()
+            self.current['items'][host] = self.current['items'].get(host, 0) + 1
+
+    v2_runner_on_ok = _on_result
+    v2_runner_on_skipped = _on_result
+    v2_runner_on_unreachable = _on_result
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._on_result(result)
+
+    v2_runner_item_on_ok = _on_item
+    v2_runner_item_on_failed = _on_item
+    v2_runner_item_on_skipped = _on_item
+
+    def v2_playbook_on_stats(self, stats):
+        self._end_task()
+        total = time() - self.start
+
+        roles = {}
+        for task in self.tasks:
+            name = task['role'] or '(play)'
+            roles[name] = roles.get(name, 0.0) + task['seconds']
+
+        profile = {
+            'seconds': round(total, 3),
+            'tasks': self.tasks,
+            'roles': dict((name, round(seconds, 3)) for name, seconds in roles.items()),
+            'aws_api_calls': self.aws,
+        }
+        with open(self.output, 'w') as f:
+            json.dump(profile, f, sort_keys=True, indent=2)
+
+        self._display.banner('PROFILE (%s)' % self.output)
+        self._display.display('Roles:')
+        for name, seconds in sorted(roles.items(), key=lambda r: r[1], reverse=True)[:self.top]:
+            self._display.display('  %-40s %8.2fs' % (name, seconds))
+        self._display.display('Tasks:')
+        for task in sorted(self.tasks, key=lambda t: t['seconds'], reverse=True)[:self.top]:
+            items = sum(task['items'].values())
+            label = '%s : %s' % (task['role'], task['task']) if task['role'] else task['task']
+            self._display.display('  %-60s %8.2fs%s' % (label[:60], task['seconds'],
+                                                        ' (%d items)' % items if items else ''))
+        if self.aws:
+            self._display.display('AWS API calls:')
+            for service, s in sorted(self.aws.items(), key=lambda a: a[1]['seconds'], reverse=True)[:self.top]:
+                retries = ' (%d retries, %d throttled)' % (s['retries'], s['throttled']) if s['retries'] else ''
+                self._display.display('  %-20s %6d calls %8.2fs%s' % (service, s['count'], s['seconds'], retries))
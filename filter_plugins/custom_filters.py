@@ -1,51 +1,133 @@
+import base64
 import os
 
 def etcd_srv_records(value, port, prefix, domain):
     result = ["0 0 %s %s-%d.%s." % (port, prefix, i, domain) for i, j in enumerate(value)]
     return result
 
+def etcd_dns_records(value, domain, prefix='etcd', ttl=600):
+    # desired etcd A records and SRV server/client records (see route53_batch module)
+    records = [{'record': '%s-%d.%s' % (prefix, i, domain), 'type': 'A', 'ttl': ttl, 'values': [ip]}
+               for i, ip in enumerate(value)]
+    if value:
+        records.append({'record': '_etcd-server._tcp.%s' % domain, 'type': 'SRV', 'ttl': ttl,
+                        'values': etcd_srv_records(value, 2380, prefix, domain)})
+        records.append({'record': '_etcd-client._tcp.%s' % domain, 'type': 'SRV', 'ttl': ttl,
+                        'values': etcd_srv_records(value, 2379, prefix, domain)})
+    return records
+
+
+def _iter_instances(value):
+    # accepts "aws ec2 describe-instances" output or a plain list of instances (ec2_remote_facts)
+    if isinstance(value, dict):
+        for reservation in value['Reservations']:
+            for instance in reservation['Instances']:
+                yield instance
+    else:
+        for instance in value:
+            yield instance
+
+def _get_tag(instance, tag_key):
+    tags = instance.get('Tags', instance.get('tags'))
+    if isinstance(tags, dict):
+        return tags.get(tag_key)
+    for tag in tags or []:
+        if tag['Key'] == tag_key:
+            return tag['Value']
+    return None
+
+def _compile_path(key):
+    # "Placement.AvailabilityZone" -> ['Placement', 'AvailabilityZone'], "tag:Name" -> tag lookup
+    if key.startswith('tag:'):
+        tag_key = key[4:]
+        return lambda instance: _get_tag(instance, tag_key)
+    parts = key.split('.')
+    def getter(instance):
+        for part in parts:
+            if instance is None:
+                return None
+            instance = instance.get(part)
+        return instance
+    return getter
 
 def ec2_instance_info(value, return_key):
     # collect results from aws ec2 describe-instances result
-    results = []
-    for reservation in value['Reservations']:
-        for instance in reservation['Instances']:
-            results.append(instance[return_key])
+    return [instance[return_key] for instance in _iter_instances(value)]
+
+def ec2_instances_extract(value, keys, by_id=False):
+    # extract several (nested or tag:) keys from all instances in a single pass
+    # returns list of tuples (or plain values for a single key string), or dict keyed by instance id
+    single = not isinstance(keys, (list, tuple))
+    if single:
+        keys = [keys]
+    getters = [_compile_path(key) for key in keys]
+
+    if by_id:
+        results = {}
+        for instance in _iter_instances(value):
+            instance_id = instance.get('InstanceId', instance.get('id'))
+            results[instance_id] = dict((key, getter(instance)) for key, getter in zip(keys, getters))
+        return results
 
-    return results
+    if single:
+        getter = getters[0]
+        return [getter(instance) for instance in _iter_instances(value)]
+    return [tuple(getter(instance) for getter in getters) for instance in _iter_instances(value)]
+
+def _subnet_index(subnets):
+    # (tag_key, tag_value) -> subnet positions, in a single pass over subnets
+    # (ec2_vpc output has "resource_tags", ec2_vpc_subnet_facts output has "tags")
+    index = {}
+    for position, item in enumerate(subnets):
+        for key, value in item.get('resource_tags', item.get('tags', {})).items():
+            index.setdefault((key, value), []).append(position)
+    return index
+
+def subnets_by_tags(value, tags, return_key=None):
+    # return subnets (or an attribute of them) that match all tags
+    if not tags:
+        matches = range(len(value))
+    else:
+        index = _subnet_index(value)
+        buckets = sorted((index.get(tag, []) for tag in tags.items()), key=len)
+        matches = set(buckets[0])
+        for bucket in buckets[1:]:
+            matches.intersection_update(bucket)
+        matches = sorted(matches)
+
+    if return_key is None:
+        return [value[i] for i in matches]
+    return [value[i][return_key] for i in matches]
 
 def get_subnets(value, tag_key, tag_value, return_key='id'):
     # return an attribute for all subnets that match
-    subnets = []
-    for item in value:
-        for key, value in item['resource_tags'].iteritems():
-            if key == tag_key and value == tag_value:
-                subnets.append(item[return_key])
-
-    return subnets
+    return subnets_by_tags(value, {tag_key: tag_value}, return_key)
 
 def get_subnets_full(value, tag_key, tag_value):
     # return subnets that match
-    subnets = []
-    for item in value:
-        for key, value in item['resource_tags'].iteritems():
-            if key == tag_key and value == tag_value:
-                subnets.append(item)
-
-    return subnets
+    return subnets_by_tags(value, {tag_key: tag_value})
 
 # parses "aws rds describe-db-instances --db-instance-identifier <id>" output to fetch the entdpoint - must be used with db-instance-identifier
 def get_rds_endpoint(db_instance):
     return db_instance['DBInstances'][0]['Endpoint']['Address']
 
+def b64encode_file(path):
+    # base64 content of a local file (same as "openssl enc -base64 -A -in <path>")
+    with open(os.path.expanduser(path), 'rb') as f:
+        return base64.b64encode(f.read()).decode('ascii')
+
 class FilterModule(object):
     ''' Ansible core jinja2 filters '''
 
     def filters(self):
         return {
             'ec2_instance_info': ec2_instance_info,
+            'ec2_instances_extract': ec2_instances_extract,
             'get_subnets': get_subnets,
             'get_subnets_full': get_subnets_full,
+            'subnets_by_tags': subnets_by_tags,
             'get_rds_endpoint': get_rds_endpoint,
             'etcd_srv_records': etcd_srv_records,
+            'etcd_dns_records': etcd_dns_records,
+            'b64encode_file': b64encode_file,
         }
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+'''
+Collect health of all cluster hosts behind the bastion.
+
+Hosts are read from the ssh_config generated by ssh_config_amazon.yaml (one
+"# <role> cluster" section per cluster). Multiplexed master connections to
+all hosts are opened (or reused) in parallel first, then every host runs the
+probes of its role as a single remote script, concurrently:
+
+    all hosts      systemctl is-active of role units, disk usage
+    etcd           etcdctl cluster-health
+    coreos         fleetctl list-machines, failed fleet units
+    elasticsearch  _cluster/health
+
+    ./fleet_health.py
+    ./fleet_health.py -F keys/us-east-1/ssh_config_dev -r etcd -r coreos --json
+'''
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+from multiprocessing.pool import ThreadPool
+from time import time
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+from switch_channel import CONTROL_PATH, SSH_CONFIG, run_remote
+
+ROLES = ['etcd', 'coreos', 'elasticsearch', 'rabbitmq']
+
+# systemd units expected to be active, by role
+UNITS = {
+    'etcd': ['etcd2'],
+    'coreos': ['etcd2', 'fleet', 'flanneld', 'docker'],
+    'elasticsearch': ['etcd2', 'fleet', 'flanneld', 'docker'],
+    'rabbitmq': ['etcd2', 'fleet', 'flanneld', 'docker'],
+}
+
+# name: command, by role
+PROBES = {
+    'etcd': [('cluster_health', 'etcdctl cluster-health')],
+    'coreos': [('machines', 'fleetctl list-machines -no-legend'),
+               ('failed_units', 'fleetctl list-units -no-legend -fields unit,active | grep -w failed || true')],
+    'elasticsearch': [('cluster_health', 'curl -sf http://localhost:9200/_cluster/health')],
+    'rabbitmq': [],
+}
+
+MARKER = '@@probe'
+
+
+def read_hosts(ssh_config):
+    ''' {role: [host]} from "# <role> cluster" sections of generated ssh_config '''
+    hosts = {}
+    role = None
+    with open(ssh_config) as f:
+        for line in f:
+            line = line.strip()
+            match = re.match(r'^#\s*(\S+) cluster', line, re.I)
+            if match:
+                role = match.group(1).lower()
+            elif line.startswith('Host ') and role in ROLES:
+                hosts.setdefault(role, []).extend(line.split()[1:])
+                role = None
+            elif line.startswith('Host '):
+                role = None
+    return hosts
+
+
+def master_alive(ssh_config, host):
+    return subprocess.call(['ssh', '-F', ssh_config, '-o', 'ControlPath=%s' % CONTROL_PATH, '-O', 'check', host],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE) == 0
+
+
+def warm_up(ssh_config, host, timeout):
+    ''' Open (or reuse) the multiplexed connection to host '''
+    start = time()
+    if master_alive(ssh_config, host):
+        return {'reused': True, 'seconds': round(time() - start, 2)}
+    # connecting through the bastion takes two connections
+    rc, out, err, seconds = run_remote(ssh_config, host, 'true', connect_timeout=timeout, timeout=2 * timeout)
+    result = {'reused': False, 'seconds': round(seconds, 2)}
+    if rc != 0:
+        result['error'] = err.strip() or 'ssh exited with %d' % rc
+    return result
+
+
+def probe_script(role, timeout):
+    ''' One remote script running all probes of role, each output followed by a marker line with its exit code.
+    A newline is printed before the marker, output without a trailing newline (curl) would hide it. '''
+    probes = [('units', 'systemctl is-active %s' % ' '.join(UNITS[role])),
+              ('disk', 'df -P -x tmpfs -x devtmpfs -x overlay')] + PROBES[role]
+    lines = []
+    for name, command in probes:
+        lines.append('timeout %d sh -c %s 2>&1; rc=$?; echo; echo "%s %s $rc"' % (timeout, quote(command), MARKER, name))
+    return '\n'.join(lines) + '\n'
+
+
+def parse_probes(out):
+    ''' {name: (rc, output)} from probe script output '''
+    results, lines = {}, []
+    for line in out.splitlines():
+        if line.startswith(MARKER + ' '):
+            _, name, rc = line.split()
+            # drop the line break printed before the marker
+            if lines and lines[-1] == '':
+                lines.pop()
+            results[name] = (int(rc), '\n'.join(lines))
+            lines = []
+        else:
+            lines.append(line)
+    return results
+
+
+def evaluate(role, probes, max_disk):
+    ''' Structured checks of a host and its problems '''
+    checks, problems = {}, []
+
+    rc, out = probes.get('units', (None, ''))
+    units = dict(zip(UNITS[role], out.split()))
+    checks['units'] = units
+    problems += ['%s is %s' % (unit, state) for unit, state in sorted(units.items()) if state != 'active']
+
+    rc, out = probes.get('disk', (None, ''))
+    disk = {}
+    for line in out.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) >= 6 and fields[4].endswith('%'):
+            disk[fields[5]] = int(fields[4][:-1])
+    checks['disk'] = disk
+    problems += ['%s %d%% used' % (mount, used) for mount, used in sorted(disk.items()) if used >= max_disk]
+
+    if 'cluster_health' in probes and role == 'etcd':
+        rc, out = probes['cluster_health']
+        healthy = len(re.findall(r'^member \w+ is healthy', out, re.M))
+        members = len(re.findall(r'^member \w+ is', out, re.M))
+        checks['etcd'] = {'healthy_members': healthy, 'members': members}
+        if rc != 0 or healthy < members or not members:
+            problems.append((out.strip().splitlines() or ['etcd cluster unavailable'])[-1])
+    elif 'cluster_health' in probes:
+        rc, out = probes['cluster_health']
+        try:
+            health = json.loads(out)
+            checks['elasticsearch'] = {'status': health['status'], 'nodes': health['number_of_nodes']}
+            if health['status'] != 'green':
+                problems.append('elasticsearch cluster is %s' % health['status'])
+        except (ValueError, KeyError):
+            problems.append('elasticsearch health unavailable')
+
+    if 'machines' in probes:
+        rc, out = probes['machines']
+        checks['fleet_machines'] = len([line for line in out.splitlines() if line.strip()])
+        if rc != 0:
+            problems.append('fleetctl list-machines failed')
+    if 'failed_units' in probes:
+        rc, out = probes['failed_units']
+        failed = [line.split()[0] for line in out.splitlines() if line.strip()]
+        checks['fleet_failed_units'] = failed
+        problems += ['fleet unit %s failed' % unit for unit in failed]
+
+    return checks, problems
+
+
+def collect(ssh_config, hosts, concurrency, timeout, max_disk):
+    ''' Warm up connections to all hosts, then probe them; [host report] '''
+    targets = [(role, host) for role in ROLES for host in hosts.get(role, [])]
+    pool = ThreadPool(max(1, min(concurrency, len(targets))))
+    try:
+        connections = pool.map(lambda target: warm_up(ssh_config, target[1], timeout), targets, chunksize=1)
+
+        def check(args):
+            (role, host), connection = args
+            report = {'host': host, 'role': role, 'connection': connection}
+            if 'error' in connection:
+                report.update(status='unreachable', problems=[connection['error']])
+                return report
+            script = probe_script(role, timeout)
+            # probes run one after another, each bounded by timeout(1)
+            deadline = (len(script.splitlines()) + 1) * timeout
+            rc, out, err, seconds = run_remote(ssh_config, host, 'sh -s', script, connect_timeout=timeout,
+                                               timeout=deadline)
+            report['seconds'] = round(seconds, 2)
+            if rc == 255:
+                report.update(status='unreachable', problems=[err.strip()])
+                return report
+            report['checks'], report['problems'] = evaluate(role, parse_probes(out), max_disk)
+            report['status'] = 'failed' if report['problems'] else 'ok'
+            return report
+
+        return pool.map(check, list(zip(targets, connections)), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def print_report(reports, total):
+    for r in sorted(reports, key=lambda r: (ROLES.index(r['role']), r['host'])):
+        print('%-14s %-16s %-12s %s' % (r['role'], r['host'], r['status'], '; '.join(r.get('problems', []))))
+    counts = dict((s, len([r for r in reports if r['status'] == s])) for s in ('ok', 'failed', 'unreachable'))
+    print('Duration: %.2f seconds (hosts: %d, ok: %d, failed: %d, unreachable: %d)' %
+          (total, len(reports), counts['ok'], counts['failed'], counts['unreachable']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect health of all cluster hosts behind the bastion')
+    parser.add_argument('-F', '--ssh-config', default=SSH_CONFIG,
+                        help='ssh config generated by ssh_config_amazon.yaml (default: %s)' % SSH_CONFIG)
+    parser.add_argument('-r', '--role', action='append', choices=ROLES,
+                        help='only check hosts of this role (can be repeated, default: all)')
+    parser.add_argument('-c', '--concurrency', type=int, default=32,
+                        help='number of hosts checked in parallel (default: 32)')
+    parser.add_argument('-t', '--timeout', type=int, default=10,
+                        help='timeout of every probe and ssh connection in seconds (default: 10)')
+    parser.add_argument('--max-disk', type=int, default=90,
+                        help='report filesystems used at least this percentage (default: 90)')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='print report as JSON')
+    args = parser.parse_args()
+
+    hosts = read_hosts(args.ssh_config)
+    if args.role:
+        hosts = dict((role, hosts.get(role, [])) for role in args.role)
+
+    start = time()
+    reports = collect(args.ssh_config, hosts, args.concurrency, args.timeout, args.max_disk)
+    total = time() - start
+
+    if args.json:
+        print(json.dumps({'hosts': reports, 'seconds': round(total, 2)}, sort_keys=True, indent=2))
+    else:
+        print_report(reports, total)
+
+    sys.exit(0 if all(r['status'] == 'ok' for r in reports) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,42 @@ the AWS_PROFILE variable:
 
 For more details, see: http://docs.pythonboto.org/en/latest/boto_config_tut.html
 
+To see where refresh time goes, use --profile-stats [FILE] or set the
+EC2_PROFILE_STATS variable (to a file name, or '-' for stderr). API calls,
+bytes received and pages per region and service, time per phase (fetch,
+build, serialize) and cache hit/miss/age are emitted as JSON.
+
+To keep the inventory in memory between Ansible runs, start a daemon:
+
+    inventory/ec2.py --daemon [SOCKET]
+
+It refreshes the inventory every cache_max_age seconds and answers --list,
+--host and --refresh-cache over a Unix socket (default:
+~/.ansible/tmp/ansible-ec2.sock, or EC2_INVENTORY_SOCKET). While the socket
+exists, this script forwards its arguments to the daemon before importing
+boto, and falls back to the direct behaviour if the daemon does not answer
+or was started with different AWS credentials settings. With the daemon,
+--host variables come from the in-memory inventory instead of a new API call.
+
+To emit only part of the inventory, use --group NAME (repeatable),
+--pattern GLOB (group names) and --env ENV (hosts tagged env=ENV), or the
+EC2_INVENTORY_GROUP (comma separated), EC2_INVENTORY_PATTERN and
+EC2_INVENTORY_ENV variables. Only the matching hosts, their groups and their
+hostvars are emitted; they are read from a group index (ansible-ec2.groups)
+and per-host hostvars (ansible-ec2.hostvars) kept with the cache.
+
+To merge several accounts into one inventory, list their boto profiles in
+ec2.ini (boto_profiles = prod,develop). Each profile is fetched in its own
+worker process, with its own credentials and cache; AWS_ACCESS_KEY_ID,
+AWS_SECRET_ACCESS_KEY, AWS_SECURITY_TOKEN, AWS_SESSION_TOKEN and AWS_PROFILE
+are ignored there. Groups are prefixed with the profile name
+(prod_tag_env_production), hostnames found in more than one account are
+prefixed too, and every host gets an ec2_boto_profile variable.
+
+With Ansible >= 2.4 the same inventory can be loaded in process, without a
+subprocess and JSON round-trip, by the gaia_ec2 inventory plugin (see
+inventory_plugins/gaia_ec2.py).
+
 When run against a specific host, this script returns the following variables:
  - ec2_ami_launch_index
  - ec2_architecture
@@ -123,8 +159,67 @@ Security groups are comma-separated in 'ec2_security_group_ids' and
 import sys
 import os
 import argparse
+import fnmatch
+import hashlib
+import multiprocessing
 import re
+import signal
+import socket
 from time import time
+
+
+# Environment that selects credentials and settings; daemon and client must agree on it
+DAEMON_ENV = ['AWS_PROFILE', 'AWS_ACCESS_KEY_ID', 'EC2_INI_PATH']
+# Environment credentials that take precedence over a boto profile, cleared in profile workers
+PROFILE_CREDENTIALS_ENV = ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN',
+                           'AWS_PROFILE']
+# Environment equivalents of --group, --pattern and --env
+SCOPE_ENV = ['EC2_INVENTORY_GROUP', 'EC2_INVENTORY_PATTERN', 'EC2_INVENTORY_ENV']
+DAEMON_SOCKET = os.path.expanduser(os.environ.get('EC2_INVENTORY_SOCKET', '~/.ansible/tmp/ansible-ec2.sock'))
+# Seconds to wait for the daemon answer (it may refresh first) before loading the inventory directly
+DAEMON_TIMEOUT = float(os.environ.get('EC2_INVENTORY_DAEMON_TIMEOUT', 120))
+
+
+def query_daemon(argv, socket_path=DAEMON_SOCKET, timeout=DAEMON_TIMEOUT):
+    ''' Sends command line arguments to a running inventory daemon (see
+    InventoryDaemon), returns its output or None if it cannot answer within
+    timeout seconds '''
+    if not os.path.exists(socket_path):
+        return None
+    import json
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(1)
+        sock.connect(socket_path)
+        # refresh may take a while, but a stalled daemon must not hang --list
+        sock.settimeout(timeout)
+        request = {'argv': argv, 'env': dict((name, os.environ.get(name)) for name in DAEMON_ENV),
+                   'scope_env': dict((name, os.environ[name]) for name in SCOPE_ENV if name in os.environ)}
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except socket.error:
+        return None
+    finally:
+        sock.close()
+    status, _, data = b''.join(chunks).partition(b'\n')
+    if status != b'OK':
+        return None
+    return data.decode('utf-8')
+
+
+# Fast path: answer from the inventory daemon without importing boto
+if __name__ == '__main__' and not set(['--daemon', '--profile-stats']) & set(sys.argv[1:]) \
+        and not os.environ.get('EC2_PROFILE_STATS'):
+    _daemon_output = query_daemon(sys.argv[1:])
+    if _daemon_output is not None:
+        print(_daemon_output)
+        sys.exit(0)
+
 import boto
 from boto import ec2
 from boto import rds
@@ -142,25 +237,301 @@ except ImportError:
     pass
 
 from six.moves import configparser
+from array import array
+from six.moves import socketserver
 from collections import defaultdict
+from contextlib import contextmanager
+import threading
 
 try:
     import json
 except ImportError:
     import simplejson as json
 
+# throttling and retries of AWS calls are shared with the gaia modules
+# (module_utils/gaia_aws.py), when the script runs from this repository
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'module_utils'))
+try:
+    import gaia_aws
+except ImportError:
+    gaia_aws = None
+
+
+def rate_limited(conn, region, service):
+    ''' Send calls of a boto connection or boto3 client through the token bucket
+    of (service, region), retrying throttled calls with backoff '''
+    if gaia_aws is None or conn is None:
+        return conn
+    if hasattr(conn, '_make_api_call'):
+        return gaia_aws.limit_client(conn)
+    return gaia_aws.limit_boto_connection(conn, service, region)
+
+
+class InventoryProfile(object):
+    ''' Opt-in profiling of inventory refresh: API calls, bytes and pages per
+    region and service, time per phase and cache usage '''
+
+    def __init__(self, output=None):
+        # output: None (disabled), '-' (stderr) or a file name
+        self.output = output
+        self.enabled = output is not None
+        self.start = time()
+        self.services = {}
+        self.phases = defaultdict(float)
+        self.cache = {}
+        self.regions = {}
+
+    def _service(self, region, service):
+        key = '%s/%s' % (region, service)
+        if key not in self.services:
+            self.services[key] = {'calls': 0, 'bytes': 0, 'pages': 0, 'seconds': 0.0, 'operations': defaultdict(int)}
+        return self.services[key]
+
+    def record_call(self, region, service, operation, seconds, size=0):
+        stats = self._service(region, service)
+        stats['calls'] += 1
+        stats['bytes'] += size
+        stats['seconds'] += seconds
+        stats['operations'][operation] += 1
+        self.phases['fetch'] += seconds
+
+    def record_bytes(self, region, service, size):
+        self._service(region, service)['bytes'] += size
+
+    def record_page(self, region, service):
+        if self.enabled:
+            self._service(region, service)['pages'] += 1
+
+    def record_regions(self, scanned, configured):
+        if self.enabled:
+            self.regions = {'scanned': len(scanned), 'skipped': len(configured) - len(scanned)}
+
+    def record_generation(self, generation, changed):
+        if self.enabled:
+            self.cache['generation'] = generation
+            self.cache['changed'] = changed
+
+    def record_cache(self, status, path=None):
+        if self.enabled:
+            self.cache['status'] = status
+            if path and os.path.isfile(path):
+                self.cache['age'] = round(time() - os.path.getmtime(path), 3)
+
+    @contextmanager
+    def phase(self, name):
+        start = time()
+        try:
+            yield
+        finally:
+            self.phases[name] += time() - start
+
+    def instrument(self, conn, region, service):
+        ''' Wrap make_request of a boto connection to count calls, time and bytes '''
+        if not self.enabled or conn is None:
+            return conn
+        make_request = conn.make_request
+        profile = self
+
+        def profiled_make_request(*args, **kwargs):
+            start = time()
+            response = make_request(*args, **kwargs)
+            profile.record_call(region, service, str(args[0]) if args else kwargs.get('action', ''), time() - start)
+            read = response.read
+            # boto caches the body, count only the first full read
+            def profiled_read(*read_args, **read_kwargs):
+                data = read(*read_args, **read_kwargs)
+                if not getattr(response, '_profiled', False):
+                    response._profiled = not read_args and not read_kwargs
+                    profile.record_bytes(region, service, len(data or ''))
+                return data
+            response.read = profiled_read
+            return response
+
+        conn.make_request = profiled_make_request
+        return conn
+
+    def instrument_boto3(self, client, region, service):
+        ''' Register botocore event hooks to count calls, time and bytes '''
+        if not self.enabled:
+            return client
+        profile = self
+
+        def before_call(context=None, **kwargs):
+            if context is not None:
+                context['profile_start'] = time()
+
+        def after_call(model, http_response=None, context=None, **kwargs):
+            start = (context or {}).get('profile_start')
+            size = len(http_response.content or '') if http_response is not None else 0
+            profile.record_call(region, service, model.name, time() - start if start else 0.0, size)
+
+        client.meta.events.register('before-call.*.*', before_call)
+        client.meta.events.register('after-call.*.*', after_call)
+        return client
+
+    def emit(self):
+        if not self.enabled:
+            return
+        data = {
+            'seconds': round(time() - self.start, 3),
+            'phases': dict((name, round(seconds, 3)) for name, seconds in self.phases.items()),
+            'cache': self.cache,
+            'regions': self.regions,
+            'services': dict((key, dict(stats, seconds=round(stats['seconds'], 3),
+                                        operations=dict(stats['operations'])))
+                             for key, stats in self.services.items()),
+            'retries': gaia_aws.RATE_LIMITER.summary() if gaia_aws else {},
+        }
+        if self.output == '-':
+            sys.stderr.write(json.dumps(data, sort_keys=True) + '\n')
+        else:
+            with open(self.output, 'w') as f:
+                json.dump(data, f, sort_keys=True, indent=2)
+
+
+class HostRecord(object):
+    ''' Hostvars of one host: a key tuple shared by hosts with the same
+    variables and a tuple of values '''
+
+    __slots__ = ('keys', 'values')
+
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+
+    def to_dict(self):
+        return dict(zip(self.keys, self.values))
+
+
+class LazyDict(dict):
+    ''' Read-only dict view whose items are produced on demand, so that
+    json can encode large data (indented encoding iterates items()) without
+    building it first '''
+
+    def __init__(self, size, items):
+        super(LazyDict, self).__init__()
+        self.size = size
+        self.produce = items
+
+    def __len__(self):
+        return self.size
+
+    def items(self):
+        return self.produce()
+
+    iteritems = items
+
+
+class HostStore(object):
+    ''' Compact inventory kept while building: host and group names are
+    stored once in a name table, groups hold arrays of name ids and hostvars
+    are HostRecord objects with shared keys and deduplicated short values.
+    to_ansible() converts to the Ansible JSON shape when it is emitted. '''
+
+    def __init__(self):
+        self.names = []
+        self.name_ids = {}
+        # group name -> array of name ids; groups with children are emitted as dicts
+        self.groups = {}
+        self.children = {}
+        # non-group top level data (e.g. db_clusters)
+        self.extra = {}
+        # name id -> HostRecord
+        self.hostvars = {}
+        self._schemas = {}
+        self._values = {}
+
+    def __len__(self):
+        return len(self.groups) + len(self.children) + len(self.extra) + len(self.hostvars)
+
+    def name_id(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def push(self, group, name):
+        hosts = self.groups.get(group)
+        if hosts is None:
+            hosts = self.groups[group] = array('l')
+        hosts.append(self.name_id(name))
+
+    def push_group(self, group, child):
+        children = self.children.setdefault(group, [])
+        if child not in children:
+            children.append(child)
+
+    def set_group(self, group, names):
+        self.groups[group] = array('l', [self.name_id(name) for name in names])
+        self.children.pop(group, None)
+
+    def _record(self, host_vars):
+        keys = tuple(sorted(host_vars))
+        keys = self._schemas.setdefault(keys, keys)
+        values = []
+        for key in keys:
+            value = host_vars[key]
+            if isinstance(value, six.string_types) and len(value) <= 64:
+                value = self._values.setdefault(value, value)
+            values.append(value)
+        return HostRecord(keys, tuple(values))
+
+    def has_hostvars(self, name):
+        return self.name_ids.get(name) in self.hostvars
+
+    def set_hostvars(self, name, host_vars):
+        self.hostvars[self.name_id(name)] = self._record(host_vars)
+
+    def update_hostvars(self, name, host_vars):
+        name_id = self.name_id(name)
+        if name_id in self.hostvars:
+            merged = self.hostvars[name_id].to_dict()
+            merged.update(host_vars)
+            host_vars = merged
+        self.hostvars[name_id] = self._record(host_vars)
+
+    def iter_hostvars(self):
+        ''' (hostname, hostvars) pairs, one host dict at a time '''
+        for i, record in self.hostvars.items():
+            yield self.names[i], record.to_dict()
+
+    def to_ansible(self, lazy=False):
+        ''' Inventory in the shape returned by --list. With lazy=True
+        hostvars are a LazyDict, for serialization only '''
+        names = self.names
+        data = {}
+        for group, hosts in self.groups.items():
+            if group not in self.children:
+                data[group] = [names[i] for i in hosts]
+        for group, children in self.children.items():
+            data[group] = {'children': list(children)}
+            hosts = self.groups.get(group)
+            if hosts:
+                data[group]['hosts'] = [names[i] for i in hosts]
+        data.update(self.extra)
+        if lazy:
+            hostvars = LazyDict(len(self.hostvars), lambda: (
+                (names[i], LazyDict(len(record.keys), lambda record=record: zip(record.keys, record.values)))
+                for i, record in self.hostvars.items()))
+        else:
+            hostvars = dict(self.iter_hostvars())
+        data['_meta'] = {'hostvars': hostvars}
+        return data
+
 
 class Ec2Inventory(object):
 
     def _empty_inventory(self):
         return {"_meta" : {"hostvars" : {}}}
 
-    def __init__(self):
-        ''' Main execution path '''
+    def __init__(self, argv=None, run=True, ini_path=None):
+        ''' Main execution path. With run=False only settings are read, for
+        use in process (see load_inventory) '''
 
         # Inventory grouped by instance IDs, tags, security groups, regions,
         # and availability zones
-        self.inventory = self._empty_inventory()
+        self.inventory = HostStore()
 
         # Index of hostname (address) to instance ID
         self.index = {}
@@ -171,8 +542,12 @@ class Ec2Inventory(object):
         # AWS credentials.
         self.credentials = {}
 
+        # ec2.ini path (default: EC2_INI_PATH or ec2.ini alongside this script)
+        self.ini_path = ini_path
+
         # Read settings and parse CLI arguments
-        self.parse_cli_args()
+        self.parse_cli_args(argv)
+        self.profile = InventoryProfile(self.args.profile_stats or os.environ.get('EC2_PROFILE_STATS'))
         self.read_settings()
 
         # Make sure that profile_name is not passed at all if not set
@@ -181,11 +556,27 @@ class Ec2Inventory(object):
             if not hasattr(boto.ec2.EC2Connection, 'profile_name'):
                 self.fail_with_error("boto version must be >= 2.24 to use profile")
 
+        if not run:
+            return
+
+        if self.args.daemon:
+            InventoryDaemon(self, self.args.daemon).serve_forever()
+            return
+
+        if self.multi_profile():
+            print(self.format_inventory(self.load_inventory(refresh=self.args.refresh_cache), self.args))
+            self.profile.emit()
+            return
+
         # Cache
         if self.args.refresh_cache:
+            self.profile.record_cache('refresh', self.cache_path_cache)
             self.do_api_calls_update_cache()
         elif not self.is_cache_valid():
+            self.profile.record_cache('miss', self.cache_path_cache)
             self.do_api_calls_update_cache()
+        else:
+            self.profile.record_cache('hit', self.cache_path_cache)
 
         # Data to print
         if self.args.host:
@@ -193,12 +584,18 @@ class Ec2Inventory(object):
 
         elif self.args.list:
             # Display list of instances for inventory
-            if self.inventory == self._empty_inventory():
-                data_to_print = self.get_inventory_from_cache()
+            scope = self.get_scope(self.args)
+            if scope:
+                data_to_print = self.get_scoped_inventory(scope)
+            elif not self.inventory:
+                with self.profile.phase('cache_read'):
+                    data_to_print = self.get_inventory_from_cache()
             else:
-                data_to_print = self.json_format_dict(self.inventory, True)
+                with self.profile.phase('serialize'):
+                    data_to_print = self.json_format_dict(self.inventory.to_ansible(lazy=True), True)
 
         print(data_to_print)
+        self.profile.emit()
 
 
     def is_cache_valid(self):
@@ -214,6 +611,96 @@ class Ec2Inventory(object):
         return False
 
 
+    def load_inventory(self, refresh=False):
+        ''' Returns the inventory from the API or from valid cache files and
+        fills self.index, for use in process (see InventoryDaemon) '''
+
+        if self.multi_profile():
+            return self.load_profiles(refresh)
+
+        self.inventory = HostStore()
+        self.index = {}
+        if refresh or not self.is_cache_valid():
+            self.profile.record_cache('refresh' if refresh else 'miss', self.cache_path_cache)
+            self.do_api_calls_update_cache()
+            return self.inventory.to_ansible()
+        self.profile.record_cache('hit', self.cache_path_cache)
+        with self.profile.phase('cache_read'):
+            data = json.loads(self.get_inventory_from_cache())
+            self.load_index_from_cache()
+        return data
+
+
+    def multi_profile(self):
+        ''' True when boto_profiles are merged (see load_profiles) '''
+        return bool(self.boto_profiles) and not self.boto_profile
+
+    def load_profiles(self, refresh=False):
+        ''' Loads the inventory of every boto profile in a worker process
+        (each with its own credentials and cache) and merges them. Workers
+        are forked: a spawned interpreter could not import this script (or
+        the gaia_ec2 plugin that loads it by path) to find the worker '''
+
+        jobs = [(self.ini_path, profile, refresh) for profile in self.boto_profiles]
+        context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+        pool = context.Pool(len(jobs))
+        try:
+            with self.profile.phase('fetch'):
+                results = pool.map(load_profile_inventory, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+        failed = [profile for profile, data in results if data is None]
+        if failed:
+            self.fail_with_error("failed to load inventory of boto profiles: %s" % ', '.join(failed))
+        with self.profile.phase('build'):
+            return self.merge_profiles(results)
+
+    def merge_profiles(self, results):
+        ''' Merges [(profile, inventory)]: groups get a profile prefix, and
+        so do hostnames that appear in more than one profile '''
+
+        accounts = defaultdict(int)
+        for profile, data in results:
+            for hostname in data['_meta']['hostvars']:
+                accounts[hostname] += 1
+
+        merged = self._empty_inventory()
+        for profile, data in results:
+            prefix = self.to_safe(profile) + '_'
+            rename = lambda hostname: prefix + hostname if accounts[hostname] > 1 else hostname
+            for name, group in data.items():
+                if name == '_meta':
+                    continue
+                if name == 'db_clusters':
+                    # cluster descriptions, not a group
+                    merged[prefix + name] = group
+                elif isinstance(group, dict):
+                    merged[prefix + name] = dict((key, [prefix + child for child in group[key]] if key == 'children'
+                                                  else [rename(hostname) for hostname in group[key]])
+                                                 for key in group)
+                else:
+                    merged[prefix + name] = [rename(hostname) for hostname in group]
+            for hostname, host_vars in data['_meta']['hostvars'].items():
+                host_vars['ec2_boto_profile'] = profile
+                merged['_meta']['hostvars'][rename(hostname)] = host_vars
+        return merged
+
+    def format_inventory(self, data, args, environ=os.environ):
+        ''' --host or (scoped) --list output of an inventory loaded in process '''
+
+        if args.host:
+            return self.json_format_dict(data['_meta']['hostvars'].get(args.host, {}), True)
+        scope = self.get_scope(args, environ)
+        if scope:
+            hostvars = data['_meta']['hostvars']
+            data = self.scope_inventory(self.get_groups(data), scope,
+                                        lambda hosts: dict((h, hostvars[h]) for h in hosts if h in hostvars))
+        with self.profile.phase('serialize'):
+            return self.json_format_dict(data, True)
+
+
     def read_settings(self):
         ''' Reads the settings from the ec2.ini file '''
         if six.PY3:
@@ -221,7 +708,8 @@ class Ec2Inventory(object):
         else:
             config = configparser.SafeConfigParser()
         ec2_default_ini_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'ec2.ini')
-        ec2_ini_path = os.path.expanduser(os.path.expandvars(os.environ.get('EC2_INI_PATH', ec2_default_ini_path)))
+        ec2_ini_path = os.path.expanduser(os.path.expandvars(
+            self.ini_path or os.environ.get('EC2_INI_PATH', ec2_default_ini_path)))
         config.read(ec2_ini_path)
 
         # is eucalyptus?
@@ -240,12 +728,19 @@ class Ec2Inventory(object):
             if self.eucalyptus_host:
                 self.regions.append(boto.connect_euca(host=self.eucalyptus_host).region.name, **self.credentials)
             else:
-                for regionInfo in ec2.regions():
-                    if regionInfo.name not in configRegions_exclude:
-                        self.regions.append(regionInfo.name)
+                # resolved once cache path is known (region list may be cached)
+                self.regions = None
         else:
             self.regions = configRegions.split(",")
 
+        # Adaptive regions: scan regions without resources on a longer TTL
+        self.regions_adaptive = False
+        if config.has_option('ec2', 'regions_adaptive'):
+            self.regions_adaptive = config.getboolean('ec2', 'regions_adaptive')
+        self.regions_empty_max_age = 3600
+        if config.has_option('ec2', 'regions_empty_max_age'):
+            self.regions_empty_max_age = config.getint('ec2', 'regions_empty_max_age')
+
         # Destination addresses
         self.destination_variable = config.get('ec2', 'destination_variable')
         self.vpc_destination_variable = config.get('ec2', 'vpc_destination_variable')
@@ -343,6 +838,11 @@ class Ec2Inventory(object):
         if config.has_option('ec2', 'boto_profile') and not self.boto_profile:
             self.boto_profile = config.get('ec2', 'boto_profile')
 
+        # boto profiles of several accounts to merge (unless a single profile is selected)
+        self.boto_profiles = []
+        if config.has_option('ec2', 'boto_profiles'):
+            self.boto_profiles = [p.strip() for p in config.get('ec2', 'boto_profiles').split(',') if p.strip()]
+
         # AWS credentials (prefer environment variables)
         if not (self.boto_profile or os.environ.get('AWS_ACCESS_KEY_ID') or
                 os.environ.get('AWS_PROFILE')):
@@ -382,8 +882,17 @@ class Ec2Inventory(object):
             cache_name = '%s-%s' % (cache_name, aws_profile())
         self.cache_path_cache = cache_dir + "/%s.cache" % cache_name
         self.cache_path_index = cache_dir + "/%s.index" % cache_name
+        self.cache_path_groups = cache_dir + "/%s.groups" % cache_name
+        self.cache_path_hostvars = cache_dir + "/%s.hostvars" % cache_name
+        self.cache_path_regions = cache_dir + "/%s.regions" % cache_name
+        self.cache_path_digests = cache_dir + "/%s.digests" % cache_name
+        self.cache_path_diff = cache_dir + "/%s.diff" % cache_name
         self.cache_max_age = config.getint('ec2', 'cache_max_age')
 
+        # with boto_profiles, regions are resolved by each profile worker
+        if self.regions is None and not self.multi_profile():
+            self.regions = self.get_all_regions(configRegions_exclude)
+
         if config.has_option('ec2', 'expand_csv_tags'):
             self.expand_csv_tags = config.getboolean('ec2', 'expand_csv_tags')
         else:
@@ -462,9 +971,54 @@ class Ec2Inventory(object):
                     continue
                 self.ec2_instance_filters[filter_key].append(filter_value)
 
-    def parse_cli_args(self):
+    def get_all_regions(self, regions_exclude):
+        ''' All EC2 regions, not excluded. With adaptive regions the list is
+        kept in the regions state file and refreshed with empty regions TTL '''
+
+        state = self.load_regions_state() if self.regions_adaptive else {}
+        if state.get('all') and state.get('all_checked', 0) + self.regions_empty_max_age > time() \
+                and not self.args.refresh_regions:
+            return state['all']
+
+        regions = [regionInfo.name for regionInfo in ec2.regions()
+                   if regionInfo.name not in regions_exclude]
+        if self.regions_adaptive:
+            state['all'] = regions
+            state['all_checked'] = time()
+            self.write_to_cache(state, self.cache_path_regions)
+        return regions
+
+    def load_regions_state(self):
+        ''' Reads regions state: {'regions': {region: {'active', 'checked'}}, 'all': [...]} '''
+        if os.path.isfile(self.cache_path_regions):
+            try:
+                with open(self.cache_path_regions, 'r') as f:
+                    return json.load(f)
+            except ValueError:
+                pass
+        return {}
+
+    def select_regions(self, state):
+        ''' Regions to scan: active ones, never checked ones and empty ones
+        with expired TTL '''
+        if not self.regions_adaptive or self.args.refresh_regions:
+            return list(self.regions)
+
+        known = state.get('regions', {})
+        now = time()
+        selected = []
+        for region in self.regions:
+            info = known.get(region)
+            if info is None or info['active'] or info['checked'] + self.regions_empty_max_age <= now:
+                selected.append(region)
+        return selected
+
+    def parse_cli_args(self, argv=None):
         ''' Command line argument processing '''
 
+        self.args = self.cli_parser().parse_args(argv)
+
+    def cli_parser(self):
         parser = argparse.ArgumentParser(description='Produce an Ansible Inventory file based on EC2')
         parser.add_argument('--list', action='store_true', default=True,
                            help='List instances (default: True)')
@@ -474,7 +1028,19 @@ class Ec2Inventory(object):
                            help='Force refresh of cache by making API requests to EC2 (default: False - use cache files)')
         parser.add_argument('--profile', '--boto-profile', action='store', dest='boto_profile',
                            help='Use boto profile for connections to EC2')
-        self.args = parser.parse_args()
+        parser.add_argument('--refresh-regions', action='store_true', default=False,
+                           help='With regions_adaptive, scan all regions including empty ones (default: False)')
+        parser.add_argument('--profile-stats', action='store', nargs='?', const='-', default=None,
+                           help='Emit refresh profiling data as JSON to stderr or to given file (or set EC2_PROFILE_STATS)')
+        parser.add_argument('--group', action='append', default=None,
+                           help='Only emit hosts of this group (may be repeated, or set EC2_INVENTORY_GROUP)')
+        parser.add_argument('--pattern', action='store', default=None,
+                           help='Only emit hosts of groups matching this glob pattern (or set EC2_INVENTORY_PATTERN)')
+        parser.add_argument('--env', action='store', default=None,
+                           help='Only emit hosts tagged with env=ENV (or set EC2_INVENTORY_ENV)')
+        parser.add_argument('--daemon', action='store', nargs='?', const=DAEMON_SOCKET, default=None,
+                           help='Keep inventory in memory and serve it over a Unix socket (default: %s)' % DAEMON_SOCKET)
+        return parser
 
 
     def do_api_calls_update_cache(self):
@@ -483,24 +1049,83 @@ class Ec2Inventory(object):
         if self.route53_enabled:
             self.get_route53_records()
 
-        for region in self.regions:
-            self.get_instances_by_region(region)
+        state = self.load_regions_state() if self.regions_adaptive else {}
+        regions = self.select_regions(state)
+        self.profile.record_regions(regions, self.regions)
+
+        for region in regions:
+            # resources returned by the API, whether or not they end up in the inventory
+            found = self.get_instances_by_region(region)
             if self.rds_enabled:
-                self.get_rds_instances_by_region(region)
+                found += self.get_rds_instances_by_region(region)
             if self.elasticache_enabled:
-                self.get_elasticache_clusters_by_region(region)
-                self.get_elasticache_replication_groups_by_region(region)
+                found += self.get_elasticache_clusters_by_region(region)
+                found += self.get_elasticache_replication_groups_by_region(region)
             if self.include_rds_clusters:
-                self.include_rds_clusters_by_region(region)
+                found += self.include_rds_clusters_by_region(region)
+            if self.regions_adaptive:
+                info = state.setdefault('regions', {}).setdefault(region, {'active': False})
+                active = found > 0
+                if active and not info['active']:
+                    # newly populated region
+                    info['activated'] = time()
+                info['active'] = active
+                info['checked'] = time()
+
+        if self.regions_adaptive:
+            self.write_to_cache(state, self.cache_path_regions)
+
+        with self.profile.phase('serialize'):
+            self.update_cache()
+
+    def update_cache(self):
+        ''' Writes the cache files if a host or group digest changed since the
+        last refresh, otherwise only renews their age. Each change starts a new
+        generation, described by the diff cache file '''
+
+        # hostvars are converted one host at a time while writing
+        data = self.inventory.to_ansible(lazy=True)
+        groups = self.get_groups(data)
+
+        # the hostvars cache is written while hosts are digested, and kept if anything changed
+        hostvars_tmp = self.cache_path_hostvars + '.tmp'
+        host_digests = self.write_hostvars_cache(self.inventory.iter_hostvars(), hostvars_tmp)
+        group_digests = sorted((name, self.digest(json.dumps(group, sort_keys=True)))
+                               for name, group in groups.items())
+        index_digest = self.digest(json.dumps(self.index, sort_keys=True))
+
+        previous = self.read_digests()
+        hosts = self.diff_digests(previous.get('hosts', []), host_digests)
+        groups_diff = self.diff_digests(previous.get('groups', []), group_digests)
+        cache_files = [self.cache_path_cache, self.cache_path_index, self.cache_path_groups,
+                       self.cache_path_hostvars, self.cache_path_digests]
+        changed = any(hosts.values()) or any(groups_diff.values()) or previous.get('index') != index_digest or \
+            not all(os.path.isfile(path) for path in cache_files)
+
+        if not changed:
+            os.remove(hostvars_tmp)
+            for path in cache_files:
+                os.utime(path, None)
+            self.profile.record_generation(previous['generation'], False)
+            return
 
-        self.write_to_cache(self.inventory, self.cache_path_cache)
+        generation = previous.get('generation', 0) + 1
+        self.write_to_cache(data, self.cache_path_cache)
         self.write_to_cache(self.index, self.cache_path_index)
+        self.write_to_cache(groups, self.cache_path_groups, pretty=False)
+        os.rename(hostvars_tmp, self.cache_path_hostvars)
+        self.write_to_cache({'generation': generation, 'previous': previous.get('generation'), 'time': int(time()),
+                             'hosts': hosts, 'groups': groups_diff}, self.cache_path_diff)
+        self.write_to_cache({'generation': generation, 'index': index_digest,
+                             'hosts': host_digests, 'groups': group_digests}, self.cache_path_digests, pretty=False)
+        self.profile.record_generation(generation, True)
 
     def connect(self, region):
         ''' create connection to api server'''
         if self.eucalyptus:
             conn = boto.connect_euca(host=self.eucalyptus_host, **self.credentials)
             conn.APIVersion = '2010-08-31'
+            conn = rate_limited(self.profile.instrument(conn, region, 'ec2'), region, 'ec2')
         else:
             conn = self.connect_to_aws(ec2, region)
         return conn
@@ -524,11 +1149,12 @@ class Ec2Inventory(object):
         # connect_to_region will fail "silently" by returning None if the region name is wrong or not supported
         if conn is None:
             self.fail_with_error("region name: %s likely not supported, or AWS is down.  connection to region failed." % region)
-        return conn
+        service = module.__name__.split('.')[-1]
+        return rate_limited(self.profile.instrument(conn, region, service), region, service)
 
     def get_instances_by_region(self, region):
         ''' Makes an AWS EC2 API call to the list of instances in a particular
-        region '''
+        region, returns the number of instances found '''
 
         try:
             conn = self.connect(region)
@@ -550,15 +1176,21 @@ class Ec2Inventory(object):
             tags = []
             for i in range(0, len(instance_ids), max_filter_value):
                 tags.extend(conn.get_all_tags(filters={'resource-type': 'instance', 'resource-id': instance_ids[i:i+max_filter_value]}))
+                self.profile.record_page(region, 'ec2')
 
             tags_by_instance_id = defaultdict(dict)
             for tag in tags:
                 tags_by_instance_id[tag.res_id][tag.name] = tag.value
 
-            for reservation in reservations:
-                for instance in reservation.instances:
-                    instance.tags = tags_by_instance_id[instance.id]
-                    self.add_instance(instance, region)
+            with self.profile.phase('build'):
+                # release boto objects as soon as each reservation is added
+                reservations.reverse()
+                while reservations:
+                    reservation = reservations.pop()
+                    for instance in reservation.instances:
+                        instance.tags = tags_by_instance_id[instance.id]
+                        self.add_instance(instance, region)
+            return len(instance_ids)
 
         except boto.exception.BotoServerError as e:
             if e.error_code == 'AuthFailure':
@@ -570,17 +1202,21 @@ class Ec2Inventory(object):
 
     def get_rds_instances_by_region(self, region):
         ''' Makes an AWS API call to the list of RDS instances in a particular
-        region '''
+        region, returns the number of instances found '''
 
+        found = 0
         try:
             conn = self.connect_to_aws(rds, region)
             if conn:
                 marker = None
                 while True:
                     instances = conn.get_all_dbinstances(marker=marker)
+                    self.profile.record_page(region, 'rds')
                     marker = instances.marker
-                    for instance in instances:
-                        self.add_rds_instance(instance, region)
+                    found += len(instances)
+                    with self.profile.phase('build'):
+                        for instance in instances:
+                            self.add_rds_instance(instance, region)
                     if not marker:
                         break
         except boto.exception.BotoServerError as e:
@@ -591,17 +1227,24 @@ class Ec2Inventory(object):
             if not e.reason == "Forbidden":
                 error = "Looks like AWS RDS is down:\n%s" % e.message
             self.fail_with_error(error, 'getting RDS instances')
+        return found
 
     def include_rds_clusters_by_region(self, region):
         if not HAS_BOTO3:
             self.fail_with_error("Working with RDS clusters requires boto3 - please install boto3 and try again",
                                  "getting RDS clusters")
 
-        client = ec2_utils.boto3_inventory_conn('client', 'rds', region, **self.credentials)
+        params = dict(self.credentials)
+        if gaia_aws is not None:
+            # the rate limiter retries, botocore must not
+            params['config'] = gaia_aws.client_config()
+        client = ec2_utils.boto3_inventory_conn('client', 'rds', region, **params)
+        rate_limited(self.profile.instrument_boto3(client, region, 'rds'), region, 'rds')
 
         marker, clusters = '', []
         while marker is not None:
             resp = client.describe_db_clusters(Marker=marker)
+            self.profile.record_page(region, 'rds')
             clusters.extend(resp["DBClusters"])
             marker = resp.get('Marker', None)
 
@@ -649,11 +1292,13 @@ class Ec2Inventory(object):
             elif matches_filter:
                 c_dict[c['DBClusterIdentifier']] = c
 
-        self.inventory['db_clusters'] = c_dict
+        self.inventory.extra['db_clusters'] = c_dict
+        return len(clusters)
 
     def get_elasticache_clusters_by_region(self, region):
         ''' Makes an AWS API call to the list of ElastiCache clusters (with
-        nodes' info) in a particular region.'''
+        nodes' info) in a particular region, returns the number of clusters
+        found '''
 
         # ElastiCache boto module doesn't provide a get_all_intances method,
         # that's why we need to call describe directly (it would be called by
@@ -684,12 +1329,14 @@ class Ec2Inventory(object):
             error = "ElastiCache query to AWS failed (unexpected format)."
             self.fail_with_error(error, 'getting ElastiCache clusters')
 
-        for cluster in clusters:
-            self.add_elasticache_cluster(cluster, region)
+        with self.profile.phase('build'):
+            for cluster in clusters:
+                self.add_elasticache_cluster(cluster, region)
+        return len(clusters)
 
     def get_elasticache_replication_groups_by_region(self, region):
         ''' Makes an AWS API call to the list of ElastiCache replication groups
-        in a particular region.'''
+        in a particular region, returns the number of groups found '''
 
         # ElastiCache boto module doesn't provide a get_all_intances method,
         # that's why we need to call describe directly (it would be called by
@@ -718,8 +1365,10 @@ class Ec2Inventory(object):
             error = "ElastiCache [Replication Groups] query to AWS failed (unexpected format)."
             self.fail_with_error(error, 'getting ElastiCache clusters')
 
-        for replication_group in replication_groups:
-            self.add_elasticache_replication_group(replication_group, region)
+        with self.profile.phase('build'):
+            for replication_group in replication_groups:
+                self.add_elasticache_replication_group(replication_group, region)
+        return len(replication_groups)
 
     def get_auth_error_message(self):
         ''' create an informative error message if there is an issue authenticating'''
@@ -805,7 +1454,7 @@ class Ec2Inventory(object):
 
         # Inventory: Group by instance ID (always a group of 1)
         if self.group_by_instance_id:
-            self.inventory[instance.id] = [hostname]
+            self.inventory.set_group(instance.id, [hostname])
             if self.nested_groups:
                 self.push_group(self.inventory, 'instances', instance.id)
 
@@ -899,8 +1548,9 @@ class Ec2Inventory(object):
         # Global Tag: tag all EC2 instances
         self.push(self.inventory, 'ec2', hostname)
 
-        self.inventory["_meta"]["hostvars"][hostname] = self.get_host_info_dict_from_instance(instance)
-        self.inventory["_meta"]["hostvars"][hostname]['ansible_ssh_host'] = dest
+        host_vars = self.get_host_info_dict_from_instance(instance)
+        host_vars['ansible_ssh_host'] = dest
+        self.inventory.set_hostvars(hostname, host_vars)
 
 
     def add_rds_instance(self, instance, region):
@@ -937,7 +1587,7 @@ class Ec2Inventory(object):
 
         # Inventory: Group by instance ID (always a group of 1)
         if self.group_by_instance_id:
-            self.inventory[instance.id] = [hostname]
+            self.inventory.set_group(instance.id, [hostname])
             if self.nested_groups:
                 self.push_group(self.inventory, 'instances', instance.id)
 
@@ -998,8 +1648,9 @@ class Ec2Inventory(object):
         # Global Tag: all RDS instances
         self.push(self.inventory, 'rds', hostname)
 
-        self.inventory["_meta"]["hostvars"][hostname] = self.get_host_info_dict_from_instance(instance)
-        self.inventory["_meta"]["hostvars"][hostname]['ansible_ssh_host'] = dest
+        host_vars = self.get_host_info_dict_from_instance(instance)
+        host_vars['ansible_ssh_host'] = dest
+        self.inventory.set_hostvars(hostname, host_vars)
 
     def add_elasticache_cluster(self, cluster, region):
         ''' Adds an ElastiCache cluster to the inventory and index, as long as
@@ -1030,7 +1681,7 @@ class Ec2Inventory(object):
 
         # Inventory: Group by instance ID (always a group of 1)
         if self.group_by_instance_id:
-            self.inventory[cluster['CacheClusterId']] = [dest]
+            self.inventory.set_group(cluster['CacheClusterId'], [dest])
             if self.nested_groups:
                 self.push_group(self.inventory, 'instances', cluster['CacheClusterId'])
 
@@ -1094,7 +1745,7 @@ class Ec2Inventory(object):
 
         host_info = self.get_host_info_dict_from_describe_dict(cluster)
 
-        self.inventory["_meta"]["hostvars"][dest] = host_info
+        self.inventory.set_hostvars(dest, host_info)
 
         # Add the nodes
         for node in cluster['CacheNodes']:
@@ -1122,7 +1773,7 @@ class Ec2Inventory(object):
 
         # Inventory: Group by node ID (always a group of 1)
         if self.group_by_instance_id:
-            self.inventory[node_id] = [dest]
+            self.inventory.set_group(node_id, [dest])
             if self.nested_groups:
                 self.push_group(self.inventory, 'instances', node_id)
 
@@ -1182,10 +1833,7 @@ class Ec2Inventory(object):
 
         host_info = self.get_host_info_dict_from_describe_dict(node)
 
-        if dest in self.inventory["_meta"]["hostvars"]:
-            self.inventory["_meta"]["hostvars"][dest].update(host_info)
-        else:
-            self.inventory["_meta"]["hostvars"][dest] = host_info
+        self.inventory.update_hostvars(dest, host_info)
 
     def add_elasticache_replication_group(self, replication_group, region):
         ''' Adds an ElastiCache replication group to the inventory and index '''
@@ -1206,7 +1854,7 @@ class Ec2Inventory(object):
 
         # Inventory: Group by ID (always a group of 1)
         if self.group_by_instance_id:
-            self.inventory[replication_group['ReplicationGroupId']] = [dest]
+            self.inventory.set_group(replication_group['ReplicationGroupId'], [dest])
             if self.nested_groups:
                 self.push_group(self.inventory, 'instances', replication_group['ReplicationGroupId'])
 
@@ -1237,13 +1885,14 @@ class Ec2Inventory(object):
 
         host_info = self.get_host_info_dict_from_describe_dict(replication_group)
 
-        self.inventory["_meta"]["hostvars"][dest] = host_info
+        self.inventory.set_hostvars(dest, host_info)
 
     def get_route53_records(self):
         ''' Get and store the map of resource records to domain names that
         point to them. '''
 
-        r53_conn = route53.Route53Connection()
+        r53_conn = rate_limited(self.profile.instrument(route53.Route53Connection(), 'global', 'route53'),
+                                'global', 'route53')
         all_zones = r53_conn.get_zones()
 
         route53_zones = [ zone for zone in all_zones if zone.name[:-1]
@@ -1444,6 +2093,8 @@ class Ec2Inventory(object):
     def push(self, my_dict, key, element):
         ''' Push an element onto an array that may not have been defined in
         the dict '''
+        if isinstance(my_dict, HostStore):
+            return my_dict.push(key, element)
         group_info = my_dict.setdefault(key, [])
         if isinstance(group_info, dict):
             host_list = group_info.setdefault('hosts', [])
@@ -1453,6 +2104,8 @@ class Ec2Inventory(object):
 
     def push_group(self, my_dict, key, element):
         ''' Push a group as a child of another group. '''
+        if isinstance(my_dict, HostStore):
+            return my_dict.push_group(key, element)
         parent_group = my_dict.setdefault(key, {})
         if not isinstance(parent_group, dict):
             parent_group = my_dict[key] = {'hosts': parent_group}
@@ -1477,14 +2130,170 @@ class Ec2Inventory(object):
         self.index = json.loads(json_index)
 
 
-    def write_to_cache(self, data, filename):
+    def write_to_cache(self, data, filename, pretty=True):
         ''' Writes data in JSON format to a file '''
 
-        json_data = self.json_format_dict(data, True)
         cache = open(filename, 'w')
-        cache.write(json_data)
+        if pretty:
+            # same output as json_format_dict, written as it is encoded
+            for chunk in json.JSONEncoder(sort_keys=True, indent=2).iterencode(data):
+                cache.write(chunk)
+        else:
+            cache.write(self.json_format_dict(data))
         cache.close()
 
+    def write_hostvars_cache(self, hostvars, filename):
+        ''' Writes (hostname, hostvars) pairs one host per line
+        ("hostname<TAB>json"), so that hosts can be read without parsing the
+        others. Returns sorted (hostname, digest of hostvars) pairs '''
+
+        digests = []
+        cache = open(filename, 'w')
+        for hostname, host_vars in hostvars:
+            json_vars = json.dumps(host_vars, sort_keys=True)
+            cache.write(hostname + '\t' + json_vars + '\n')
+            digests.append((hostname, self.digest(json_vars)))
+        cache.close()
+        digests.sort()
+        return digests
+
+    def read_digests(self):
+        ''' Digests of the last generation written to the cache '''
+
+        if not os.path.isfile(self.cache_path_digests):
+            return {}
+        try:
+            with open(self.cache_path_digests, 'r') as cache:
+                return json.load(cache)
+        except ValueError:
+            return {}
+
+    def digest(self, text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def diff_digests(self, old, new):
+        ''' Compares two lists of (key, digest) pairs sorted by key, in a
+        single pass over both '''
+
+        added, removed, modified = [], [], []
+        i = j = 0
+        while i < len(old) or j < len(new):
+            if j == len(new) or (i < len(old) and old[i][0] < new[j][0]):
+                removed.append(old[i][0])
+                i += 1
+            elif i == len(old) or new[j][0] < old[i][0]:
+                added.append(new[j][0])
+                j += 1
+            else:
+                if old[i][1] != new[j][1]:
+                    modified.append(new[j][0])
+                i += 1
+                j += 1
+        return {'added': added, 'removed': removed, 'modified': modified}
+
+    def read_hostvars_cache(self, hostnames):
+        ''' Reads hostvars of given hosts from the hostvars cache file '''
+
+        hostvars = {}
+        with open(self.cache_path_hostvars, 'r') as cache:
+            for line in cache:
+                hostname, _, json_vars = line.partition('\t')
+                if hostname in hostnames:
+                    hostvars[hostname] = json.loads(json_vars)
+        return hostvars
+
+    def get_groups(self, inventory):
+        ''' Group to hosts/children index: the inventory without hostvars '''
+        return dict((name, group) for name, group in inventory.items() if name != '_meta')
+
+    def get_scope(self, args, environ=os.environ):
+        ''' Returns (groups, pattern, env) requested by --group, --pattern
+        and --env (or environment variables), None for the whole inventory '''
+
+        groups = args.group or [g for g in environ.get('EC2_INVENTORY_GROUP', '').split(',') if g]
+        pattern = args.pattern or environ.get('EC2_INVENTORY_PATTERN')
+        env = args.env or environ.get('EC2_INVENTORY_ENV')
+        if not (groups or pattern or env):
+            return None
+        return (groups, pattern, env)
+
+    def scope_inventory(self, groups_index, scope, get_hostvars):
+        ''' Returns the inventory limited to hosts of the scope groups: their
+        groups (with other hosts removed) and their hostvars '''
+
+        groups, pattern, env = scope
+
+        def hosts_of(name, seen):
+            group = groups_index.get(name, [])
+            if not isinstance(group, dict):
+                return set(group)
+            hosts = set(group.get('hosts', []))
+            for child in group.get('children', []):
+                if child not in seen:
+                    seen.add(child)
+                    hosts |= hosts_of(child, seen)
+            return hosts
+
+        # with boto_profiles, group names also match the groups of every profile
+        prefixes = [''] + ([self.to_safe(p) + '_' for p in self.boto_profiles] if self.multi_profile() else [])
+
+        selected = set(prefix + name for name in groups for prefix in prefixes if prefix + name in groups_index)
+        if pattern:
+            for prefix in prefixes:
+                selected.update(fnmatch.filter(groups_index, prefix + pattern))
+        hosts = set()
+        for name in selected:
+            hosts |= hosts_of(name, set([name]))
+        if env:
+            env_hosts = set()
+            for prefix in prefixes:
+                env_name = prefix + self.to_safe('tag_env=' + env)
+                env_hosts |= hosts_of(env_name, set([env_name]))
+            hosts = hosts & env_hosts if (groups or pattern) else env_hosts
+
+        data = {}
+        for name, group in groups_index.items():
+            if isinstance(group, dict):
+                kept = {}
+                group_hosts = [h for h in group.get('hosts', []) if h in hosts]
+                children = [c for c in group.get('children', []) if hosts_of(c, set([c])) & hosts]
+                if group_hosts:
+                    kept['hosts'] = group_hosts
+                if children:
+                    kept['children'] = children
+                if kept:
+                    data[name] = kept
+            else:
+                group_hosts = [h for h in group if h in hosts]
+                if group_hosts:
+                    data[name] = group_hosts
+        data['_meta'] = {'hostvars': get_hostvars(hosts)}
+        return data
+
+    def get_scoped_inventory(self, scope):
+        ''' Inventory limited to scope as JSON, read from the group index
+        and hostvars cache files unless the inventory was just fetched '''
+
+        if not self.inventory:
+            if os.path.isfile(self.cache_path_groups) and os.path.isfile(self.cache_path_hostvars):
+                with self.profile.phase('cache_read'):
+                    with open(self.cache_path_groups, 'r') as cache:
+                        groups_index = json.load(cache)
+                    data = self.scope_inventory(groups_index, scope, self.read_hostvars_cache)
+                with self.profile.phase('serialize'):
+                    return self.json_format_dict(data, True)
+            # cache written before the group index existed
+            with self.profile.phase('cache_read'):
+                inventory = json.loads(self.get_inventory_from_cache())
+        else:
+            inventory = self.inventory.to_ansible()
+
+        hostvars = inventory['_meta']['hostvars']
+        data = self.scope_inventory(self.get_groups(inventory), scope,
+                                    lambda hosts: dict((h, hostvars[h]) for h in hosts if h in hostvars))
+        with self.profile.phase('serialize'):
+            return self.json_format_dict(data, True)
+
     def uncammelize(self, key):
         temp = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', key)
         return re.sub('([a-z0-9])([A-Z])', r'\1_\2', temp).lower()
@@ -1506,5 +2315,121 @@ class Ec2Inventory(object):
             return json.dumps(data)
 
 
+def load_profile_inventory(job):
+    ''' Worker of Ec2Inventory.load_profiles: returns (profile, inventory),
+    inventory is None if it could not be loaded '''
+    ini_path, profile, refresh = job
+    # boto prefers environment credentials to the profile, which would make
+    # every worker query the same account
+    for name in PROFILE_CREDENTIALS_ENV:
+        os.environ.pop(name, None)
+    try:
+        inventory = Ec2Inventory(argv=['--boto-profile', profile], run=False, ini_path=ini_path)
+        return profile, inventory.load_inventory(refresh=refresh)
+    except SystemExit:
+        # fail_with_error already wrote the reason to stderr
+        return profile, None
+
+
+class InventoryDaemon(object):
+    ''' Keeps the inventory, index and Route53 map of an Ec2Inventory in
+    memory, refreshes them every cache_max_age seconds and answers --list,
+    --host and --refresh-cache requests over a Unix socket (see query_daemon) '''
+
+    def __init__(self, inventory, socket_path):
+        self.inventory = inventory
+        self.socket_path = socket_path
+        self.env = dict((name, os.environ.get(name)) for name in DAEMON_ENV)
+        self.interval = max(inventory.cache_max_age, 60)
+        self.lock = threading.Lock()
+        self.list_output = None
+        self.data = self.inventory._empty_inventory()
+
+    def refresh(self, force=False):
+        ''' Reloads the inventory and swaps the served snapshot '''
+        with self.lock:
+            self.inventory.profile = InventoryProfile(self.inventory.profile.output)
+            data = self.inventory.load_inventory(refresh=force)
+            with self.inventory.profile.phase('serialize'):
+                list_output = self.inventory.json_format_dict(data, True)
+            self.inventory.profile.emit()
+            self.list_output, self.data = list_output, data
+
+    def refresh_loop(self):
+        while True:
+            threading.Event().wait(self.interval)
+            try:
+                self.refresh(force=True)
+            except Exception as e:
+                sys.stderr.write("inventory refresh failed: %s\n" % e)
+
+    def handle(self, request):
+        ''' Returns output for a request, None if it should be answered directly '''
+        if request.get('env') != self.env:
+            return None
+        try:
+            args = self.inventory.cli_parser().parse_args(request['argv'])
+        except SystemExit:
+            return None
+        if args.boto_profile != self.inventory.args.boto_profile or args.daemon or args.profile_stats:
+            return None
+        if args.refresh_cache:
+            self.refresh(force=True)
+        scope_env = request.get('scope_env', {})
+        if args.host or self.inventory.get_scope(args, scope_env):
+            return self.inventory.format_inventory(self.data, args, scope_env)
+        return self.list_output
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                self.inventory.fail_with_error("inventory daemon already running on %s" % self.socket_path)
+            except socket.error:
+                # stale socket of a daemon that is gone
+                os.unlink(self.socket_path)
+            finally:
+                probe.close()
+
+        self.refresh()
+        refresher = threading.Thread(target=self.refresh_loop)
+        refresher.daemon = True
+        refresher.start()
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    output = daemon.handle(json.loads(self.rfile.readline().decode('utf-8')))
+                except Exception as e:
+                    sys.stderr.write("inventory request failed: %s\n" % e)
+                    output = None
+                if output is None:
+                    self.wfile.write(b'FALLBACK\n')
+                else:
+                    self.wfile.write(b'OK\n' + output.encode('utf-8'))
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        old_umask = os.umask(0o077)
+        try:
+            server = Server(self.socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+        # remove socket on kill as well
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(self.socket_path)
+
+
 # Run the script
-Ec2Inventory()
+if __name__ == '__main__':
+    Ec2Inventory()
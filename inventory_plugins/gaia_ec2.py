@@ -0,0 +1,131 @@
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This Ansible plugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this plugin.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+EC2 inventory loaded in process (Ansible >= 2.4).
+
+Runs the Ec2Inventory logic of inventory/ec2.py inside Ansible and adds
+groups, hosts and hostvars through the inventory API, instead of running the
+script and parsing its JSON output. ec2.ini settings and cache files are the
+same as for the script.
+
+Enable the plugin and point Ansible at a config file named *gaia_ec2.yml
+(outside of the inventory/ directory, which Ansible 2.2 reads as scripts):
+
+    # ansible.cfg (inventory_plugins is already set)
+    [inventory]
+    enable_plugins = gaia_ec2, script, ini
+
+    # develop.gaia_ec2.yml
+    plugin: gaia_ec2
+    ini_path: inventory/ec2.ini   # default: EC2_INI_PATH or inventory/ec2.ini
+    boto_profile: develop         # optional
+    refresh_cache: false          # optional, same as ec2.py --refresh-cache
+
+    ansible-playbook -i develop.gaia_ec2.yml site.yaml
+'''
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    name: gaia_ec2
+    plugin_type: inventory
+    short_description: EC2 inventory of inventory/ec2.py, loaded in process
+    description:
+        - Builds the same groups and hostvars as inventory/ec2.py, honouring ec2.ini and its cache files.
+    options:
+        plugin:
+            description: token that ensures this is a source file for the plugin.
+            required: True
+            choices: ['gaia_ec2']
+        ini_path:
+            description: path to ec2.ini
+        boto_profile:
+            description: boto profile to use
+        refresh_cache:
+            description: ignore cache files and make API calls
+            type: boolean
+            default: False
+'''
+
+import imp
+import os
+
+from ansible.errors import AnsibleParserError
+from ansible.plugins.inventory import BaseInventoryPlugin
+
+# keys of a group given as a dict, anything else at the top level is data (db_clusters)
+GROUP_KEYS = frozenset(['hosts', 'children', 'vars'])
+
+EC2_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'inventory', 'ec2.py')
+
+
+class InventoryModule(BaseInventoryPlugin):
+
+    NAME = 'gaia_ec2'
+
+    def verify_file(self, path):
+        return super(InventoryModule, self).verify_file(path) and \
+            path.endswith(('gaia_ec2.yml', 'gaia_ec2.yaml'))
+
+    def parse(self, inventory, loader, path, cache=True):
+        super(InventoryModule, self).parse(inventory, loader, path)
+
+        config = loader.load_from_file(path) or {}
+        if config.get('plugin') != self.NAME:
+            raise AnsibleParserError("%s is not a gaia_ec2 inventory config" % path)
+
+        argv = []
+        if config.get('boto_profile'):
+            argv += ['--boto-profile', config['boto_profile']]
+
+        ini_path = config.get('ini_path')
+        if ini_path and not os.path.isabs(ini_path):
+            ini_path = os.path.join(loader.get_basedir(), ini_path)
+
+        ec2_script = imp.load_source('gaia_ec2_inventory', EC2_SCRIPT)
+        try:
+            ec2 = ec2_script.Ec2Inventory(argv=argv, run=False, ini_path=ini_path)
+            data = ec2.load_inventory(refresh=bool(config.get('refresh_cache')))
+        except SystemExit:
+            # Ec2Inventory.fail_with_error already wrote the reason to stderr
+            raise AnsibleParserError("failed to load EC2 inventory with %s" % path)
+
+        self._populate(data)
+
+    def _populate(self, data):
+        hostvars = data.get('_meta', {}).get('hostvars', {})
+
+        for group_name, group in data.items():
+            if group_name == '_meta':
+                continue
+            if isinstance(group, dict) and not (group and GROUP_KEYS.issuperset(group)):
+                # extra data of the script output (db_clusters), not a group
+                self.inventory.set_variable('all', group_name, group)
+                continue
+            if isinstance(group, dict):
+                hosts, children = group.get('hosts', []), group.get('children', [])
+            else:
+                hosts, children = group, []
+            self.inventory.add_group(group_name)
+            for host in hosts:
+                self.inventory.add_host(host, group=group_name)
+            for child in children:
+                self.inventory.add_group(child)
+                self.inventory.add_child(group_name, child)
+
+        for host, variables in hostvars.items():
+            self.inventory.add_host(host)
+            for name, value in variables.items():
+                self.inventory.set_variable(host, name, value)
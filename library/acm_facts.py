@@ -19,6 +19,8 @@ module: acm_facts
 short_description: Gather facts about AWS ACM
 description:
     - Gather facts about AWS ACM Certificates
+    - All pages of the certificate list are fetched and results may be filtered by domain name
+    - Certificate list and details may be cached on disk, since certificates rarely change
 version_added: "2.2"
 author: "Alexei Ledenev (@alexeiled)"
 options:
@@ -32,6 +34,32 @@ options:
       - The status or statuses on which to filter the list of ACM Certificates U(http://docs.aws.amazon.com/acm/latest/APIReference/API_ListCertificates.html) for possible statuses.
     required: false
     default: null
+  domain_name:
+    description:
+      - Return only certificates issued for this domain name.
+      - Matches certificate domain name exactly, or a wildcard certificate (C(*.example.com)) that covers it.
+    required: false
+    default: null
+  details:
+    description:
+      - Fetch certificate details (C(describe_certificate)) for every matching certificate.
+    required: false
+    default: false
+  workers:
+    description:
+      - Number of concurrent C(describe_certificate) calls, when I(details=true).
+    required: false
+    default: 8
+  cache_path:
+    description:
+      - Directory to keep cached certificate lists in.
+    required: false
+    default: ~/.ansible/tmp
+  cache_max_age:
+    description:
+      - The number of seconds a cache file is considered valid. Set to 0 to disable the cache.
+    required: false
+    default: 0
 '''
 
 EXAMPLES = '''
@@ -46,8 +74,21 @@ EXAMPLES = '''
     region: us-east-1
     certificate_statuses: [ 'ISSUED' ]
 
+# Get ISSUED certificates for "gaiahub.io" with details, cached for an hour
+- acm_facts:
+    region: us-east-1
+    certificate_statuses: [ 'ISSUED' ]
+    domain_name: gaiahub.io
+    details: true
+    cache_max_age: 3600
+
 '''
 
+import json
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
 try:
     import botocore
     import boto3
@@ -62,20 +103,133 @@ def get_cert_info(cert):
 
     return cert_info
 
-def list_certificates(client, module):
+def get_cert_details(cert):
+    # keep JSON friendly subset of describe_certificate output
+    details = { 'status': cert.get('Status'),
+                'type': cert.get('Type'),
+                'issuer': cert.get('Issuer'),
+                'key_algorithm': cert.get('KeyAlgorithm'),
+                'subject_alternative_names': cert.get('SubjectAlternativeNames', []),
+                'in_use_by': cert.get('InUseBy', []),
+               }
+    for key, name in (('NotBefore', 'not_before'), ('NotAfter', 'not_after')):
+        details[name] = cert[key].isoformat() if cert.get(key) else None
 
-    certificate_statuses = module.params.get("certificate_statuses")
+    return details
+
+def domain_matches(cert_domain, domain_name):
+    # exact match or wildcard certificate covering a single label
+    if cert_domain == domain_name:
+        return True
+    if cert_domain.startswith('*.'):
+        parts = domain_name.split('.', 1)
+        return len(parts) == 2 and parts[1] == cert_domain[2:]
+    return False
+
+def get_cache_file(module, region, certificate_statuses):
+    cache_dir = os.path.expanduser(module.params.get('cache_path'))
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    statuses = '_'.join(sorted(certificate_statuses)) or 'all'
+    return os.path.join(cache_dir, 'acm-facts-%s-%s.json' % (region, statuses))
+
+def read_cache(cache_file, max_age):
+    if max_age <= 0 or not os.path.isfile(cache_file):
+        return None
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+    except ValueError:
+        return None
+    # age is counted from the list_certificates call, not from the last write
+    if cache.get('timestamp', 0) + max_age <= time.time():
+        return None
+    return cache
+
+def write_cache(cache_file, data):
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp_file, cache_file)
+
+def fetch_certificates(client, module, certificate_statuses):
     cert_dict_array = []
 
     try:
-        all_certs = client.list_certificates(CertificateStatuses=certificate_statuses)
+        paginator = client.get_paginator('list_certificates')
+        for response in paginator.paginate(CertificateStatuses=certificate_statuses):
+            for cert in response['CertificateSummaryList']:
+                cert_dict_array.append(get_cert_info(cert))
     except botocore.exceptions.ClientError as e:
-        module.fail_json(msg="Boto3 Client Error - " + str(e.msg))
+        module.fail_json(msg="Boto3 Client Error - " + str(e))
+
+    return cert_dict_array
+
+def describe_certificates(client, module, arns):
+    workers = max(1, min(module.params.get('workers'), len(arns)))
+
+    def describe(arn):
+        try:
+            return arn, get_cert_details(client.describe_certificate(CertificateArn=arn)['Certificate']), None
+        except botocore.exceptions.ClientError as e:
+            return arn, None, str(e)
+
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(describe, arns)
+    finally:
+        pool.close()
+        pool.join()
+
+    details = {}
+    for arn, cert_details, error in results:
+        if error:
+            module.fail_json(msg="Boto3 Client Error - " + error)
+        details[arn] = cert_details
+
+    return details
+
+def filter_certificates(certificates, domain_name):
+    if not domain_name:
+        return certificates
+    return [cert for cert in certificates if domain_matches(cert['domain_name'], domain_name)]
+
+def list_certificates(client, module, region):
+
+    certificate_statuses = module.params.get("certificate_statuses")
+    domain_name = module.params.get("domain_name")
+    with_details = module.params.get("details")
+    cache_max_age = module.params.get("cache_max_age")
+
+    cache_file = None
+    cache = None
+    if cache_max_age > 0:
+        cache_file = get_cache_file(module, region, certificate_statuses)
+        cache = read_cache(cache_file, cache_max_age)
+        # a certificate may have been issued since, do not trust a cached empty answer
+        if cache is not None and not filter_certificates(cache['certificates'], domain_name):
+            cache = None
+    cache_changed = cache is None
+    if cache is None:
+        cache = { 'certificates': fetch_certificates(client, module, certificate_statuses),
+                  'details': {},
+                  'timestamp': time.time()
+                 }
+
+    cert_dict_array = filter_certificates(cache['certificates'], domain_name)
+
+    if with_details and cert_dict_array:
+        missing = [cert['arn'] for cert in cert_dict_array if cert['arn'] not in cache['details']]
+        if missing:
+            cache['details'].update(describe_certificates(client, module, missing))
+            cache_changed = True
+        cert_dict_array = [dict(cert, details=cache['details'][cert['arn']]) for cert in cert_dict_array]
 
-    for cert in all_certs['CertificateSummaryList']:
-        cert_dict_array.append(get_cert_info(cert))
+    # empty results are not cached
+    if cache_file and cache_changed and cert_dict_array:
+        write_cache(cache_file, cache)
 
-    module.exit_json(certificates=cert_dict_array)
+    module.exit_json(certificates=cert_dict_array, aws_api_calls=aws_api_calls())
 
 
 def main():
@@ -84,6 +238,11 @@ def main():
         dict(
             certificate_statuses=dict(type='list', default=[]),
             region=dict(required=True, aliases=['aws_region', 'ec2_region']),
+            domain_name=dict(required=False, default=None),
+            details=dict(type='bool', default=False),
+            workers=dict(type='int', default=8),
+            cache_path=dict(required=False, default='~/.ansible/tmp'),
+            cache_max_age=dict(type='int', default=0),
         )
     )
 
@@ -97,16 +256,17 @@ def main():
 
     if region:
         try:
-            client = boto3_conn(module=module, conn_type='client', resource='acm', region=region, **aws_connect_params)
+            client = instrument_client(boto3_conn(module=module, conn_type='client', resource='acm', region=region, config=client_config(), **aws_connect_params))
         except botocore.exceptions.ClientError as e:
             module.fail_json(msg="Boto3 Client Error - " + str(e.msg))
     else:
         module.fail_json(msg="region must be specified")
 
-    list_certificates(client, module)
+    list_certificates(client, module, region)
 
 from ansible.module_utils.basic import *
 from ansible.module_utils.ec2 import *
+from ansible.module_utils.gaia_aws import client_config, instrument_client, aws_api_calls
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,508 @@
+#!/usr/bin/python
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This Ansible library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+DOCUMENTATION = '''
+---
+module: ec2_asg_rolling_update
+short_description: Replace autoscaling group instances in batches, gated on cluster health
+description:
+    - Replaces instances of an autoscaling group that do not run C(launch_config_name), in batches of
+      C(batch_size) (a percentage of the desired capacity, or a number of instances).
+    - For every batch the group is scaled out by the batch size; once the new instances are InService
+      (and InService in the group's load balancers) and the cluster is healthy, the old instances are
+      terminated and the cluster must be healthy again before the next batch.
+    - Batches take instances from every availability zone in turn.
+    - Cluster health is probed on all instances concurrently, over ssh through the bastion
+      (multiplexed connections, see C(ssh_key) and C(bastion_tags)). The rollout stops at the first batch
+      that does not become healthy within C(health_timeout).
+    - Desired capacity and max size of the group are restored when the rollout ends, also when it fails; if
+      a batch was scaled out, the group's termination policy picks the instances to scale in. Old instances
+      left are replaced on the next run.
+    - "Probes: C(etcd) - healthy members in C(etcdctl cluster-health); C(coreos) - machines with
+      C(general=true) metadata in C(fleetctl list-machines); C(elasticsearch) - nodes in C(_cluster/health)
+      when the status is C(elasticsearch_status) or better; C(rabbitmq) - running nodes of the management API."
+version_added: "2.2"
+options:
+  region:
+    description:
+      - The AWS region to use.
+    required: true
+    aliases: ['aws_region', 'ec2_region']
+  asg_name:
+    description:
+      - Autoscaling group to update.
+    required: true
+  launch_config_name:
+    description:
+      - Launch configuration instances are replaced with; set on the group if needed. Defaults to the
+        group's launch configuration, which resumes a rollout that stopped half way.
+    required: false
+  batch_size:
+    description:
+      - Instances replaced at once, as a percentage of the desired capacity (C(34%)) or a number.
+    required: false
+    default: '34%'
+  cluster_type:
+    description:
+      - Health probe to gate batches on, C(none) to only wait for InService instances.
+    required: false
+    default: none
+    choices: ['coreos', 'etcd', 'elasticsearch', 'rabbitmq', 'none']
+  health_command:
+    description:
+      - Custom health probe run on every instance; healthy when it exits with 0. Overrides C(cluster_type) probe.
+    required: false
+  min_healthy_nodes:
+    description:
+      - Nodes every probe must report. Defaults to the desired capacity (a quorum of it for etcd).
+    required: false
+  elasticsearch_status:
+    description:
+      - Lowest Elasticsearch cluster status considered healthy.
+    required: false
+    default: green
+    choices: ['green', 'yellow']
+  rabbitmq_credentials:
+    description:
+      - C(user:password) of the RabbitMQ management API.
+    required: false
+    default: 'guest:guest'
+  ssh_user:
+    description:
+      - User of cluster instances.
+    required: false
+    default: core
+  ssh_key:
+    description:
+      - Private key of cluster instances. Required for health probes.
+    required: false
+  bastion_tags:
+    description:
+      - Tags of the bastion instance, which proxies ssh connections to cluster instances.
+    required: false
+  bastion_user:
+    description:
+      - User of the bastion.
+    required: false
+    default: ubuntu
+  bastion_key:
+    description:
+      - Private key of the bastion.
+    required: false
+  wait_timeout:
+    description:
+      - Seconds to wait for new instances to be InService, and old ones to be terminated.
+    required: false
+    default: 600
+  health_timeout:
+    description:
+      - Seconds to wait for the cluster to be healthy after every step.
+    required: false
+    default: 600
+  probe_timeout:
+    description:
+      - Seconds a health probe may run on an instance; a probe that takes longer counts as unhealthy.
+    required: false
+    default: 30
+  poll_interval:
+    description:
+      - Seconds between checks of instances and cluster health.
+    required: false
+    default: 5
+  workers:
+    description:
+      - Number of concurrent health probes.
+    required: false
+    default: 10
+requirements:
+  - boto3
+'''
+
+EXAMPLES = '''
+# Note: These examples do not set authentication details, see the AWS Guide for details.
+
+# Replace Elasticsearch nodes a third at a time, waiting for a green cluster
+- ec2_asg_rolling_update:
+    region: us-east-1
+    asg_name: elasticsearch-asg-dev
+    launch_config_name: elasticsearch-lc-dev1234
+    batch_size: 34%
+    cluster_type: elasticsearch
+    ssh_key: keys/us-east-1/coreos-key-dev.pem
+    bastion_tags: { "Name": "bastion", "group": "gaia", "env": "develop", "type": "bastion-vm" }
+    bastion_key: keys/us-east-1/bastion-key-dev.pem
+'''
+
+RETURN = '''
+replaced:
+    description: Ids of terminated instances
+    returned: always
+    type: list
+    sample: ["i-0a1b2c3d"]
+batches:
+    description: Replaced and launched instances of every batch, with its duration
+    returned: always
+    type: list
+    sample: [{"terminated": ["i-0a1b2c3d"], "launched": ["i-4e5f6a7b"], "seconds": 184.2}]
+health:
+    description: Result of the last health probe of every instance
+    returned: when cluster health is probed
+    type: list
+    sample: [{"ip": "10.10.3.55", "nodes": 3, "healthy": true}]
+'''
+
+import json
+import os
+import re
+import subprocess
+import threading
+from multiprocessing.pool import ThreadPool
+from time import sleep, time
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    import botocore
+    import boto3
+    HAS_BOTO3 = True
+except ImportError:
+    HAS_BOTO3 = False
+
+# same control path as ssh_config generated by ssh_config_amazon.yaml
+CONTROL_PATH = '~/.ssh/mux-%r@%h:%p'
+ES_STATUS = {'green': 2, 'yellow': 1, 'red': 0}
+# exit code of timeout(1) when the command timed out
+TIMEOUT_EXIT = 124
+# seconds ssh may take on top of the probe (ConnectTimeout of the instance and of the bastion)
+SSH_MARGIN = 30
+
+
+class RolloutError(Exception):
+    pass
+
+
+def count_etcd(out, module):
+    return len(re.findall(r'^member \w+ is healthy', out, re.M))
+
+def count_fleet(out, module):
+    # Elasticsearch and RabbitMQ nodes join fleet too, coreos nodes have general=true metadata
+    return len([line for line in out.splitlines() if 'general=true' in line.strip().split(',')])
+
+def count_elasticsearch(out, module):
+    health = json.loads(out)
+    if ES_STATUS.get(health['status'], 0) < ES_STATUS[module.params['elasticsearch_status']]:
+        return 0
+    return health['number_of_nodes']
+
+def count_rabbitmq(out, module):
+    return len([node for node in json.loads(out) if node.get('running')])
+
+# cluster_type: (command, number of healthy nodes seen by the node)
+HEALTH_PROBES = {
+    'etcd': (lambda module: 'etcdctl cluster-health', count_etcd),
+    'coreos': (lambda module: 'fleetctl list-machines -no-legend -fields metadata', count_fleet),
+    'elasticsearch': (lambda module: 'curl -sf -m %d http://localhost:9200/_cluster/health' % module.params['probe_timeout'],
+                      count_elasticsearch),
+    'rabbitmq': (lambda module: 'curl -sf -m %d -u %s http://localhost:15672/api/nodes' % (
+                     module.params['probe_timeout'], quote(module.params['rabbitmq_credentials'])),
+                 count_rabbitmq),
+}
+
+
+def ssh_command(module, bastion, ip, command):
+    ''' ssh command line to ip through the bastion, reusing (or creating) multiplexed
+    connections to both. The generated ssh_config lists known instances only. '''
+    params = module.params
+    proxy = ' '.join(['ssh', '-q', '-i', params['bastion_key'],
+                      '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=10', '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
+                      '-o', 'ControlMaster=auto', '-o', 'ControlPersist=10m',
+                      # no %-tokens, they would be expanded for the instance
+                      '-o', 'ControlPath=~/.ssh/mux-%s@%s' % (params['bastion_user'], bastion),
+                      '%s@%s' % (params['bastion_user'], bastion), '-W', '%h:%p'])
+    return ['ssh', '-i', params['ssh_key'],
+            '-o', 'User=%s' % params['ssh_user'],
+            '-o', 'BatchMode=yes', '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
+            '-o', 'ConnectTimeout=10',
+            '-o', 'ControlMaster=auto', '-o', 'ControlPath=%s' % CONTROL_PATH, '-o', 'ControlPersist=10m',
+            '-o', 'ProxyCommand=%s' % proxy,
+            ip, command]
+
+def probe(module, bastion, ip):
+    ''' Run the health probe on ip, return {ip, healthy, nodes[, error]} '''
+    params = module.params
+    if params['health_command']:
+        command, count = params['health_command'], None
+    else:
+        make_command, count = HEALTH_PROBES[params['cluster_type']]
+        command = make_command(module)
+    command = 'timeout %d sh -c %s' % (params['probe_timeout'], quote(command))
+
+    proc = subprocess.Popen(ssh_command(module, bastion, ip, command),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    # timeout(1) bounds the probe, the timer a hung ssh connection
+    timer = threading.Timer(params['probe_timeout'] + SSH_MARGIN, proc.kill)
+    timer.start()
+    try:
+        out, err = proc.communicate()
+    finally:
+        timer.cancel()
+    result = {'ip': ip, 'healthy': False, 'nodes': None}
+    if proc.returncode == TIMEOUT_EXIT or proc.returncode < 0:
+        result['error'] = 'probe timed out'
+        return result
+    # etcdctl cluster-health exits with 1 while a member is down, healthy members are counted anyway
+    if proc.returncode != 0 and not (count is count_etcd and proc.returncode != 255):
+        result['error'] = err.strip() or out.strip()
+        return result
+    if count is None:
+        result['healthy'] = True
+        return result
+    try:
+        result['nodes'] = count(out, module)
+    except (ValueError, KeyError, TypeError) as e:
+        result['error'] = 'unexpected probe output: %s' % e
+        return result
+    result['healthy'] = result['nodes'] >= params['min_healthy_nodes']
+    return result
+
+
+class RollingUpdate(object):
+
+    def __init__(self, module, autoscaling, ec2, elb):
+        self.module = module
+        self.params = module.params
+        self.autoscaling = autoscaling
+        self.ec2 = ec2
+        self.elb = elb
+        self.bastion = None
+        self.health = []
+
+    def describe_asg(self):
+        groups = self.autoscaling.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[self.params['asg_name']])['AutoScalingGroups']
+        if not groups:
+            raise RolloutError('autoscaling group %s not found' % self.params['asg_name'])
+        return groups[0]
+
+    def wait_for(self, what, check, timeout):
+        deadline = time() + timeout
+        while True:
+            result = check()
+            if result:
+                return result
+            if time() > deadline:
+                raise RolloutError('timeout waiting for %s' % what)
+            sleep(self.params['poll_interval'])
+
+    def in_service(self, asg):
+        return [i['InstanceId'] for i in asg['Instances']
+                if i['LifecycleState'] == 'InService' and i['HealthStatus'] == 'Healthy']
+
+    def in_service_elb(self, asg, instance_ids):
+        for name in asg.get('LoadBalancerNames', []):
+            states = self.elb.describe_instance_health(LoadBalancerName=name,
+                                                       Instances=[{'InstanceId': i} for i in instance_ids])
+            if any(s['State'] != 'InService' for s in states['InstanceStates']):
+                return False
+        return True
+
+    def private_ips(self, instance_ids):
+        if not instance_ids:
+            return []
+        reservations = self.ec2.describe_instances(InstanceIds=instance_ids)['Reservations']
+        return sorted(i['PrivateIpAddress'] for r in reservations for i in r['Instances'] if i.get('PrivateIpAddress'))
+
+    def find_bastion(self):
+        filters = [{'Name': 'instance-state-name', 'Values': ['running']}]
+        filters += [{'Name': 'tag:' + k, 'Values': [v]} for k, v in self.params['bastion_tags'].items()]
+        reservations = self.ec2.describe_instances(Filters=filters)['Reservations']
+        names = [i['PublicDnsName'] for r in reservations for i in r['Instances'] if i.get('PublicDnsName')]
+        if not names:
+            raise RolloutError('no running bastion with tags %s' % self.params['bastion_tags'])
+        return names[0]
+
+    def probe_cluster(self):
+        ''' Probe all InService instances concurrently, True when all are healthy '''
+        ips = self.private_ips(self.in_service(self.describe_asg()))
+        pool = ThreadPool(max(1, min(self.params['workers'], len(ips))))
+        try:
+            self.health = pool.map(lambda ip: probe(self.module, self.bastion, ip), ips)
+        finally:
+            pool.close()
+            pool.join()
+        return bool(self.health) and all(r['healthy'] for r in self.health)
+
+    def wait_healthy(self, step):
+        if self.params['cluster_type'] == 'none' and not self.params['health_command']:
+            return
+        try:
+            self.wait_for('healthy cluster %s' % step, self.probe_cluster, self.params['health_timeout'])
+        except RolloutError:
+            errors = ['%s: %s' % (r['ip'], r.get('error', '%s nodes' % r['nodes'])) for r in self.health
+                      if not r['healthy']]
+            raise RolloutError('cluster not healthy %s: %s' % (step, '; '.join(errors) or 'no instances'))
+
+    def plan(self, asg):
+        ''' Old instances in batches, taking instances from every availability zone in turn '''
+        zones = {}
+        for instance in sorted(asg['Instances'], key=lambda i: i['InstanceId']):
+            if instance.get('LaunchConfigurationName') != self.params['launch_config_name']:
+                zones.setdefault(instance['AvailabilityZone'], []).append(instance['InstanceId'])
+        ordered = []
+        while any(zones.values()):
+            for zone in sorted(zones):
+                if zones[zone]:
+                    ordered.append(zones[zone].pop(0))
+
+        batch_size = str(self.params['batch_size']).strip()
+        if batch_size.endswith('%'):
+            # rounded down, as "serial" of a play
+            size = int(asg['DesiredCapacity'] * float(batch_size[:-1]) / 100)
+        else:
+            size = int(batch_size)
+        size = max(1, size)
+        return [ordered[i:i + size] for i in range(0, len(ordered), size)]
+
+    def replace(self, asg, batch):
+        name = self.params['asg_name']
+        desired = asg['DesiredCapacity']
+        before = set(i['InstanceId'] for i in asg['Instances'])
+        start = time()
+
+        # scale out by the batch, new instances use the new launch configuration
+        self.autoscaling.update_auto_scaling_group(AutoScalingGroupName=name, DesiredCapacity=desired + len(batch),
+                                                   MaxSize=max(asg['MaxSize'], desired + len(batch)))
+
+        def launched():
+            current = self.describe_asg()
+            new = [i for i in self.in_service(current) if i not in before]
+            if len(new) >= len(batch) and self.in_service_elb(current, new):
+                return new
+        new = self.wait_for('new instances of %s' % name, launched, self.params['wait_timeout'])
+        self.wait_healthy('with new instances %s' % ', '.join(new))
+
+        for instance_id in batch:
+            self.autoscaling.terminate_instance_in_auto_scaling_group(InstanceId=instance_id,
+                                                                      ShouldDecrementDesiredCapacity=True)
+
+        def terminated():
+            return not set(batch) & set(i['InstanceId'] for i in self.describe_asg()['Instances'])
+        self.wait_for('termination of %s' % ', '.join(batch), terminated, self.params['wait_timeout'])
+        self.wait_healthy('without instances %s' % ', '.join(batch))
+        return {'terminated': batch, 'launched': new, 'seconds': round(time() - start, 1)}
+
+    def run(self):
+        asg = self.describe_asg()
+        if not self.params['launch_config_name']:
+            self.params['launch_config_name'] = asg['LaunchConfigurationName']
+        batches = self.plan(asg)
+        result = {'changed': bool(batches), 'replaced': [], 'batches': []}
+        if not batches or self.module.check_mode:
+            result['batches'] = [{'terminated': batch} for batch in batches]
+            return result
+
+        desired, max_size = asg['DesiredCapacity'], asg['MaxSize']
+        if self.params['min_healthy_nodes'] is None:
+            self.params['min_healthy_nodes'] = desired // 2 + 1 if self.params['cluster_type'] == 'etcd' else desired
+        if self.params['cluster_type'] != 'none' or self.params['health_command']:
+            self.bastion = self.find_bastion()
+
+        if asg['LaunchConfigurationName'] != self.params['launch_config_name']:
+            self.autoscaling.update_auto_scaling_group(AutoScalingGroupName=self.params['asg_name'],
+                                                       LaunchConfigurationName=self.params['launch_config_name'])
+        try:
+            # do not start on a cluster that is already failing
+            self.wait_healthy('before update')
+            for batch in batches:
+                result['batches'].append(self.replace(self.describe_asg(), batch))
+                result['replaced'].extend(batch)
+        except RolloutError as e:
+            result['msg'] = '%s (%d of %d batches done)' % (e, len(result['batches']), len(batches))
+            result['failed'] = True
+        finally:
+            # replace() scales out by a batch, do not leave a failed batch scaled out
+            self.autoscaling.update_auto_scaling_group(AutoScalingGroupName=self.params['asg_name'],
+                                                       DesiredCapacity=desired, MaxSize=max_size)
+        if self.health:
+            result['health'] = self.health
+        return result
+
+
+def main():
+    argument_spec = ec2_argument_spec()
+    argument_spec.update(
+        dict(
+            region=dict(required=True, aliases=['aws_region', 'ec2_region']),
+            asg_name=dict(required=True),
+            launch_config_name=dict(required=False),
+            batch_size=dict(default='34%'),
+            cluster_type=dict(default='none', choices=['coreos', 'etcd', 'elasticsearch', 'rabbitmq', 'none']),
+            health_command=dict(required=False),
+            min_healthy_nodes=dict(type='int', required=False),
+            elasticsearch_status=dict(default='green', choices=['green', 'yellow']),
+            rabbitmq_credentials=dict(default='guest:guest', no_log=True),
+            ssh_user=dict(default='core'),
+            ssh_key=dict(required=False),
+            bastion_tags=dict(type='dict', required=False),
+            bastion_user=dict(default='ubuntu'),
+            bastion_key=dict(required=False),
+            wait_timeout=dict(type='int', default=600),
+            health_timeout=dict(type='int', default=600),
+            probe_timeout=dict(type='int', default=30),
+            poll_interval=dict(type='int', default=5),
+            workers=dict(type='int', default=10),
+        )
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True)
+
+    # Validate Requirements
+    if not HAS_BOTO3:
+        module.fail_json(msg='botocore/boto3 is required.')
+    if (module.params['cluster_type'] != 'none' or module.params['health_command']) and \
+            not (module.params['ssh_key'] and module.params['bastion_tags'] and module.params['bastion_key']):
+        module.fail_json(msg='ssh_key, bastion_tags and bastion_key are required to probe cluster health')
+
+    for key in ('ssh_key', 'bastion_key'):
+        if module.params[key]:
+            module.params[key] = os.path.expanduser(module.params[key])
+
+    region, ec2_url, aws_connect_params = get_aws_connection_info(module, True)
+    if not region:
+        module.fail_json(msg="region must be specified")
+
+    try:
+        clients = [instrument_client(boto3_conn(module=module, conn_type='client', resource=resource, region=region,
+                                                config=client_config(), **aws_connect_params))
+                   for resource in ('autoscaling', 'ec2', 'elb')]
+        result = RollingUpdate(module, *clients).run()
+    except botocore.exceptions.ClientError as e:
+        module.fail_json(msg="Boto3 Client Error - " + str(e))
+    except RolloutError as e:
+        module.fail_json(msg=str(e))
+
+    if result.pop('failed', False):
+        module.fail_json(aws_api_calls=aws_api_calls(), **result)
+    module.exit_json(aws_api_calls=aws_api_calls(), **result)
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.ec2 import *
+from ansible.module_utils.gaia_aws import client_config, instrument_client, aws_api_calls
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This Ansible library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+DOCUMENTATION = '''
+---
+module: ec2_asg_source_dest_check
+short_description: Set source/destination check for all instances of an autoscaling group
+description:
+    - Finds running instances of an autoscaling group with a different source/destination check
+      setting and updates them concurrently, using a single pooled EC2 client.
+    - Disabling the check is needed for flannel VPC backend.
+version_added: "2.2"
+options:
+  region:
+    description:
+      - The AWS region to use.
+    required: true
+    aliases: ['aws_region', 'ec2_region']
+  asg_name:
+    description:
+      - Name of the autoscaling group.
+    required: true
+  source_dest_check:
+    description:
+      - Desired source/destination check value.
+    required: false
+    default: false
+  workers:
+    description:
+      - Number of concurrent ModifyInstanceAttribute calls.
+    required: false
+    default: 10
+requirements:
+  - boto3
+'''
+
+EXAMPLES = '''
+# Note: These examples do not set authentication details, see the AWS Guide for details.
+
+# Turn off source destination check for all coreos nodes
+- ec2_asg_source_dest_check:
+    region: us-east-1
+    asg_name: coreos-asg-dev
+'''
+
+RETURN = '''
+instance_ids:
+    description: Instances that were updated
+    returned: always
+    type: list
+    sample: ["i-0a1b2c3d"]
+'''
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    import botocore
+    import botocore.config
+    import boto3
+    HAS_BOTO3 = True
+except ImportError:
+    HAS_BOTO3 = False
+
+def find_instances(client, asg_name, source_dest_check):
+    instance_ids = []
+    paginator = client.get_paginator('describe_instances')
+    filters = [
+        {'Name': 'instance-state-name', 'Values': ['running']},
+        {'Name': 'tag:aws:autoscaling:groupName', 'Values': [asg_name]},
+        {'Name': 'source-dest-check', 'Values': ['false' if source_dest_check else 'true']},
+    ]
+    for response in paginator.paginate(Filters=filters):
+        for reservation in response['Reservations']:
+            for instance in reservation['Instances']:
+                instance_ids.append(instance['InstanceId'])
+
+    return instance_ids
+
+def update_instances(client, module):
+    asg_name = module.params.get('asg_name')
+    source_dest_check = module.params.get('source_dest_check')
+
+    try:
+        instance_ids = find_instances(client, asg_name, source_dest_check)
+    except botocore.exceptions.ClientError as e:
+        module.fail_json(msg="Boto3 Client Error - " + str(e))
+
+    if not instance_ids or module.check_mode:
+        module.exit_json(changed=bool(instance_ids), instance_ids=instance_ids, aws_api_calls=aws_api_calls())
+
+    def modify(instance_id):
+        try:
+            client.modify_instance_attribute(InstanceId=instance_id,
+                                             SourceDestCheck={'Value': source_dest_check})
+            return instance_id, None
+        except botocore.exceptions.ClientError as e:
+            return instance_id, str(e)
+
+    pool = ThreadPool(max(1, min(module.params.get('workers'), len(instance_ids))))
+    try:
+        results = pool.map(modify, instance_ids)
+    finally:
+        pool.close()
+        pool.join()
+
+    errors = ['%s: %s' % (instance_id, error) for instance_id, error in results if error]
+    if errors:
+        module.fail_json(msg="Boto3 Client Error - " + '; '.join(errors),
+                         instance_ids=[instance_id for instance_id, error in results if not error])
+
+    module.exit_json(changed=True, instance_ids=instance_ids, aws_api_calls=aws_api_calls())
+
+
+def main():
+    argument_spec = ec2_argument_spec()
+    argument_spec.update(
+        dict(
+            region=dict(required=True, aliases=['aws_region', 'ec2_region']),
+            asg_name=dict(required=True),
+            source_dest_check=dict(type='bool', default=False),
+            workers=dict(type='int', default=10),
+        )
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True)
+
+    # Validate Requirements
+    if not HAS_BOTO3:
+        module.fail_json(msg='botocore/boto3 is required.')
+
+    region, ec2_url, aws_connect_params = get_aws_connection_info(module, True)
+
+    if region:
+        try:
+            # share one connection pool between worker threads
+            config = client_config(max_pool_connections=module.params.get('workers'))
+            client = instrument_client(boto3_conn(module=module, conn_type='client', resource='ec2', region=region,
+                                                  config=config, **aws_connect_params))
+        except botocore.exceptions.ClientError as e:
+            module.fail_json(msg="Boto3 Client Error - " + str(e))
+    else:
+        module.fail_json(msg="region must be specified")
+
+    update_instances(client, module)
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.ec2 import *
+from ansible.module_utils.gaia_aws import client_config, instrument_client, aws_api_calls
+
+if __name__ == '__main__':
+    main()
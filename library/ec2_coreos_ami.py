@@ -0,0 +1,264 @@
+#!/usr/bin/python
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This Ansible library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+DOCUMENTATION = '''
+---
+module: ec2_coreos_ami
+short_description: Resolve CoreOS channel and version to an AMI, with a local cache
+description:
+    - Finds the C(CoreOS-<channel>-<version>-<virtualization_type>) AMI published by C(owner) with one
+      DescribeImages call filtered by owner, exact name and state, instead of searching and sorting public images.
+    - Resolved AMIs are kept in a local cache file for C(cache_ttl) seconds, keyed by owner, region, channel,
+      version and virtualization type; AWS is called only when the pinned version changes or the entry expires.
+    - With C(regions), every region is resolved concurrently.
+version_added: "2.2"
+options:
+  region:
+    description:
+      - The AWS region to use.
+    required: true
+    aliases: ['aws_region', 'ec2_region']
+  regions:
+    description:
+      - Regions to resolve, besides C(region); returned in C(amis).
+    required: false
+    default: []
+  channel:
+    description:
+      - CoreOS release channel.
+    required: false
+    default: stable
+    choices: ['alpha', 'beta', 'stable']
+  version:
+    description:
+      - CoreOS version, e.g. C(1122.2.0). C(current) resolves to the most recent AMI of the channel; it is
+        never cached, since a new release supersedes it.
+    required: true
+  virtualization_type:
+    description:
+      - Virtualization type of the AMI.
+    required: false
+    default: hvm
+    choices: ['hvm', 'paravirtual']
+  owner:
+    description:
+      - Account id that publishes the CoreOS AMIs.
+    required: false
+    default: '595879546273'
+  cache_path:
+    description:
+      - Cache file; resolved AMIs are shared by runs of all environments.
+    required: false
+    default: ~/.ansible/tmp/coreos-ami.json
+  cache_ttl:
+    description:
+      - Seconds a cached AMI is valid, 0 to always call AWS. Not used with C(version=current).
+    required: false
+    default: 86400
+  workers:
+    description:
+      - Number of regions resolved concurrently.
+    required: false
+    default: 8
+requirements:
+  - boto3
+'''
+
+EXAMPLES = '''
+# Note: These examples do not set authentication details, see the AWS Guide for details.
+
+# AMI of CoreOS stable 1122.2.0
+- ec2_coreos_ami:
+    region: us-east-1
+    channel: stable
+    version: 1122.2.0
+  register: _coreos
+
+# Same AMI in several regions
+- ec2_coreos_ami:
+    region: us-east-1
+    regions: [ us-west-2, eu-west-1, eu-central-1 ]
+    channel: stable
+    version: 1122.2.0
+  register: _coreos
+'''
+
+RETURN = '''
+ami:
+    description: AMI of C(region), with the keys returned by ec2_ami_find
+    returned: always
+    type: dict
+    sample: {
+        "ami_id": "ami-1a2b3c4d", "name": "CoreOS-stable-1122.2.0-hvm", "region": "us-east-1",
+        "owner_id": "595879546273", "architecture": "x86_64", "virtualization_type": "hvm",
+        "root_device_type": "ebs", "creationDate": "2016-09-06T23:36:48.000Z",
+        "description": "CoreOS stable 1122.2.0 (HVM)", "cached": true
+    }
+amis:
+    description: AMI by region, of C(region) and C(regions)
+    returned: always
+    type: dict
+'''
+
+import json
+import os
+from multiprocessing.pool import ThreadPool
+from time import time
+
+try:
+    import botocore
+    import boto3
+    HAS_BOTO3 = True
+except ImportError:
+    HAS_BOTO3 = False
+
+
+def cache_key(module, region):
+    params = module.params
+    return '/'.join([params['owner'], region, params['channel'], params['version'], params['virtualization_type']])
+
+def read_cache(path):
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def write_cache(path, entries):
+    ''' Merge entries into the cache file, which other runs may have updated meanwhile '''
+    cache = read_cache(path)
+    cache.update(entries)
+    cache_dir = os.path.dirname(path)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, sort_keys=True, indent=2)
+    os.rename(tmp_path, path)
+
+def image_info(image, region):
+    return {
+        'ami_id': image['ImageId'],
+        'name': image['Name'],
+        'region': region,
+        'owner_id': image['OwnerId'],
+        'architecture': image.get('Architecture'),
+        'virtualization_type': image.get('VirtualizationType'),
+        'root_device_type': image.get('RootDeviceType'),
+        'creationDate': image.get('CreationDate'),
+        'description': image.get('Description'),
+    }
+
+def find_ami(module, aws_connect_params, region):
+    params = module.params
+    version = '*' if params['version'] == 'current' else params['version']
+    name = 'CoreOS-%s-%s-%s' % (params['channel'], version, params['virtualization_type'])
+
+    client = instrument_client(boto3_conn(module=module, conn_type='client', resource='ec2', region=region,
+                                          config=client_config(), **aws_connect_params))
+    images = client.describe_images(Owners=[params['owner']],
+                                    Filters=[{'Name': 'name', 'Values': [name]},
+                                             {'Name': 'virtualization-type', 'Values': [params['virtualization_type']]},
+                                             {'Name': 'state', 'Values': ['available']}])['Images']
+    if not images:
+        return None
+    # most recent first, for "current"
+    images.sort(key=lambda image: image.get('CreationDate', ''), reverse=True)
+    return image_info(images[0], region)
+
+def resolve(module, aws_connect_params, regions):
+    cache_path = os.path.expanduser(module.params['cache_path'])
+    # the most recent AMI changes with every release, only pinned versions are cached
+    ttl = module.params['cache_ttl'] if module.params['version'] != 'current' else 0
+    cache = read_cache(cache_path) if ttl > 0 else {}
+
+    amis, missing = {}, []
+    for region in regions:
+        entry = cache.get(cache_key(module, region))
+        if entry and entry['time'] + ttl > time():
+            amis[region] = dict(entry['ami'], cached=True)
+        else:
+            missing.append(region)
+
+    def call(region):
+        try:
+            return region, find_ami(module, aws_connect_params, region), None
+        except botocore.exceptions.ClientError as e:
+            return region, None, str(e)
+
+    if missing:
+        pool = ThreadPool(max(1, min(module.params['workers'], len(missing))))
+        try:
+            results = pool.map(call, missing)
+        finally:
+            pool.close()
+            pool.join()
+
+        errors = ['%s: %s' % (region, error) for region, ami, error in results if error]
+        if errors:
+            module.fail_json(msg="Boto3 Client Error - " + '; '.join(errors))
+        not_found = [region for region, ami, error in results if ami is None]
+        if not_found:
+            module.fail_json(msg="No CoreOS %s %s %s AMI owned by %s in %s" % (
+                module.params['channel'], module.params['version'], module.params['virtualization_type'],
+                module.params['owner'], ', '.join(not_found)))
+
+        for region, ami, error in results:
+            amis[region] = dict(ami, cached=False)
+        if ttl > 0:
+            write_cache(cache_path, dict((cache_key(module, region), {'ami': ami, 'time': int(time())})
+                                         for region, ami, error in results))
+    return amis
+
+
+def main():
+    argument_spec = ec2_argument_spec()
+    argument_spec.update(
+        dict(
+            region=dict(required=True, aliases=['aws_region', 'ec2_region']),
+            regions=dict(type='list', default=[]),
+            channel=dict(default='stable', choices=['alpha', 'beta', 'stable']),
+            version=dict(required=True),
+            virtualization_type=dict(default='hvm', choices=['hvm', 'paravirtual']),
+            owner=dict(default='595879546273'),
+            cache_path=dict(default='~/.ansible/tmp/coreos-ami.json'),
+            cache_ttl=dict(type='int', default=86400),
+            workers=dict(type='int', default=8),
+        )
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True)
+
+    # Validate Requirements
+    if not HAS_BOTO3:
+        module.fail_json(msg='botocore/boto3 is required.')
+
+    region, ec2_url, aws_connect_params = get_aws_connection_info(module, True)
+    if not region:
+        module.fail_json(msg="region must be specified")
+
+    regions = [region] + [r for r in module.params['regions'] if r != region]
+    amis = resolve(module, aws_connect_params, regions)
+
+    module.exit_json(changed=False, ami=amis[region], amis=amis, aws_api_calls=aws_api_calls())
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.ec2 import *
+from ansible.module_utils.gaia_aws import client_config, instrument_client, aws_api_calls
+
+if __name__ == '__main__':
+    main()
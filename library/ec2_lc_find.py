@@ -194,7 +194,7 @@ def find_launch_configs(client, module):
     if limit:
         results = results[:int(limit)]
 
-    module.exit_json(changed=False, results=results)
+    module.exit_json(changed=False, results=results, aws_api_calls=aws_api_calls())
 
 
 def main():
@@ -213,13 +213,14 @@ def main():
 
     region, ec2_url, aws_connect_params = get_aws_connection_info(module, True)
 
-    client = boto3_conn(module=module, conn_type='client', resource='autoscaling', region=region, **aws_connect_params)
+    client = instrument_client(boto3_conn(module=module, conn_type='client', resource='autoscaling', region=region, config=client_config(), **aws_connect_params))
     find_launch_configs(client, module)
 
 
 # import module snippets
 from ansible.module_utils.basic import *
 from ansible.module_utils.ec2 import *
+from ansible.module_utils.gaia_aws import client_config, instrument_client, aws_api_calls
 
 if __name__ == '__main__':
     main()
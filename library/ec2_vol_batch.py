@@ -0,0 +1,276 @@
+#!/usr/bin/python
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This Ansible library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+DOCUMENTATION = '''
+---
+module: ec2_vol_batch
+short_description: Create or delete a set of named EBS volumes in one task
+description:
+    - Finds existing volumes with one DescribeVolumes call, computes create/delete plan
+      and executes it concurrently. Waiters are shared by all volumes.
+    - Volumes are matched by C(Name) tag within the availability zone, volume type and tags.
+version_added: "2.2"
+options:
+  region:
+    description:
+      - The AWS region to use.
+    required: true
+    aliases: ['aws_region', 'ec2_region']
+  zone:
+    description:
+      - Availability zone of the volumes.
+    required: true
+  names:
+    description:
+      - Names (C(Name) tag) of the volumes.
+    required: true
+  volume_size:
+    description:
+      - Size of new volumes in GB.
+    required: false
+  volume_type:
+    description:
+      - Type of the volumes (gp2, io1, standard, ...).
+    required: false
+    default: gp2
+  iops:
+    description:
+      - Provisioned IOPS, for io1 volumes.
+    required: false
+  tags:
+    description:
+      - Tags to set on volumes (besides C(Name)); used to find volumes too.
+    required: false
+    default: {}
+  state:
+    description:
+      - Create (present) or detach and delete (absent) volumes.
+    required: false
+    default: present
+    choices: ['present', 'absent']
+  workers:
+    description:
+      - Number of concurrent API calls.
+    required: false
+    default: 10
+requirements:
+  - boto3
+'''
+
+EXAMPLES = '''
+# Note: These examples do not set authentication details, see the AWS Guide for details.
+
+# Create 3 elasticsearch volumes
+- ec2_vol_batch:
+    region: us-east-1
+    zone: us-east-1a
+    names: [ es-1-develop, es-2-develop, es-3-develop ]
+    volume_size: 80
+    volume_type: gp2
+    tags: { "group": "gaia", "env": "develop", "purpose": "elasticsearch" }
+
+# Detach and delete them
+- ec2_vol_batch:
+    region: us-east-1
+    zone: us-east-1a
+    names: [ es-1-develop, es-2-develop, es-3-develop ]
+    volume_type: gp2
+    tags: { "group": "gaia", "env": "develop", "purpose": "elasticsearch" }
+    state: absent
+'''
+
+RETURN = '''
+volumes:
+    description: Volumes matching requested names after the change
+    returned: always
+    type: list
+    sample: [{"id": "vol-0a1b2c3d", "name": "es-1-develop", "state": "available"}]
+created:
+    description: Ids of created volumes
+    returned: always
+    type: list
+deleted:
+    description: Ids of deleted volumes
+    returned: always
+    type: list
+'''
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    import botocore
+    import botocore.config
+    import boto3
+    HAS_BOTO3 = True
+except ImportError:
+    HAS_BOTO3 = False
+
+def get_tag(volume, key):
+    for tag in volume.get('Tags', []):
+        if tag['Key'] == key:
+            return tag['Value']
+    return None
+
+def find_volumes(client, module):
+    filters = [
+        {'Name': 'availability-zone', 'Values': [module.params.get('zone')]},
+        {'Name': 'volume-type', 'Values': [module.params.get('volume_type')]},
+        {'Name': 'tag:Name', 'Values': module.params.get('names')},
+    ]
+    for key, value in module.params.get('tags').items():
+        filters.append({'Name': 'tag:%s' % key, 'Values': [str(value)]})
+
+    volumes = []
+    paginator = client.get_paginator('describe_volumes')
+    for response in paginator.paginate(Filters=filters):
+        volumes.extend(response['Volumes'])
+    return volumes
+
+def run_concurrently(module, func, args):
+    ''' Call func for every argument in a thread pool, fail on any ClientError '''
+    if not args:
+        return []
+
+    def call(arg):
+        try:
+            return func(arg), None
+        except botocore.exceptions.ClientError as e:
+            return None, str(e)
+
+    pool = ThreadPool(max(1, min(module.params.get('workers'), len(args))))
+    try:
+        results = pool.map(call, args)
+    finally:
+        pool.close()
+        pool.join()
+
+    errors = [error for result, error in results if error]
+    if errors:
+        module.fail_json(msg="Boto3 Client Error - " + '; '.join(errors))
+    return [result for result, error in results]
+
+def volume_info(volume):
+    return {'id': volume['VolumeId'], 'name': get_tag(volume, 'Name'), 'state': volume['State']}
+
+def ensure_present(client, module):
+    names = module.params.get('names')
+    tags = dict((k, str(v)) for k, v in module.params.get('tags').items())
+    volumes = find_volumes(client, module)
+    existing = set(get_tag(volume, 'Name') for volume in volumes)
+    missing = [name for name in names if name not in existing]
+
+    if module.check_mode:
+        module.exit_json(changed=bool(missing), volumes=[volume_info(v) for v in volumes],
+                         created=[], deleted=[], aws_api_calls=aws_api_calls())
+
+    def create(name):
+        params = {
+            'AvailabilityZone': module.params.get('zone'),
+            'Size': module.params.get('volume_size'),
+            'VolumeType': module.params.get('volume_type'),
+            'TagSpecifications': [{
+                'ResourceType': 'volume',
+                'Tags': [{'Key': k, 'Value': v} for k, v in dict(tags, Name=name).items()],
+            }],
+        }
+        if module.params.get('iops'):
+            params['Iops'] = module.params.get('iops')
+        return client.create_volume(**params)
+
+    if missing and not module.params.get('volume_size'):
+        module.fail_json(msg="volume_size is required to create volumes")
+    created = run_concurrently(module, create, missing)
+
+    created_ids = [volume['VolumeId'] for volume in created]
+    try:
+        if created_ids:
+            client.get_waiter('volume_available').wait(VolumeIds=created_ids)
+    except botocore.exceptions.ClientError as e:
+        module.fail_json(msg="Boto3 Client Error - " + str(e))
+
+    volumes = [volume_info(v) for v in volumes] + \
+              [{'id': v['VolumeId'], 'name': name, 'state': 'available'} for v, name in zip(created, missing)]
+    module.exit_json(changed=bool(created), volumes=volumes,
+                     created=created_ids, deleted=[], aws_api_calls=aws_api_calls())
+
+def ensure_absent(client, module):
+    volumes = find_volumes(client, module)
+
+    if module.check_mode or not volumes:
+        module.exit_json(changed=bool(volumes), volumes=[volume_info(v) for v in volumes],
+                         created=[], deleted=[], aws_api_calls=aws_api_calls())
+
+    attached = [volume['VolumeId'] for volume in volumes if volume['State'] == 'in-use']
+    run_concurrently(module, lambda volume_id: client.detach_volume(VolumeId=volume_id), attached)
+    try:
+        if attached:
+            client.get_waiter('volume_available').wait(VolumeIds=attached)
+    except botocore.exceptions.ClientError as e:
+        module.fail_json(msg="Boto3 Client Error - " + str(e))
+
+    deleted = [volume['VolumeId'] for volume in volumes]
+    run_concurrently(module, lambda volume_id: client.delete_volume(VolumeId=volume_id), deleted)
+
+    module.exit_json(changed=True, volumes=[], created=[], deleted=deleted, aws_api_calls=aws_api_calls())
+
+
+def main():
+    argument_spec = ec2_argument_spec()
+    argument_spec.update(
+        dict(
+            region=dict(required=True, aliases=['aws_region', 'ec2_region']),
+            zone=dict(required=True),
+            names=dict(type='list', required=True),
+            volume_size=dict(type='int', required=False),
+            volume_type=dict(required=False, default='gp2'),
+            iops=dict(type='int', required=False),
+            tags=dict(type='dict', default={}),
+            state=dict(required=False, default='present', choices=['present', 'absent']),
+            workers=dict(type='int', default=10),
+        )
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True)
+
+    # Validate Requirements
+    if not HAS_BOTO3:
+        module.fail_json(msg='botocore/boto3 is required.')
+
+    region, ec2_url, aws_connect_params = get_aws_connection_info(module, True)
+
+    if region:
+        try:
+            config = client_config(max_pool_connections=module.params.get('workers'))
+            client = instrument_client(boto3_conn(module=module, conn_type='client', resource='ec2', region=region,
+                                                  config=config, **aws_connect_params))
+        except botocore.exceptions.ClientError as e:
+            module.fail_json(msg="Boto3 Client Error - " + str(e))
+    else:
+        module.fail_json(msg="region must be specified")
+
+    try:
+        if module.params.get('state') == 'present':
+            ensure_present(client, module)
+        else:
+            ensure_absent(client, module)
+    except botocore.exceptions.ClientError as e:
+        module.fail_json(msg="Boto3 Client Error - " + str(e))
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.ec2 import *
+from ansible.module_utils.gaia_aws import client_config, instrument_client, aws_api_calls
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/python
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This Ansible library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+DOCUMENTATION = '''
+---
+module: ec2_vpc_network_facts
+short_description: Gather network facts of a VPC in one call
+description:
+    - Gathers subnets (grouped by C(tier) tag), NAT gateways, their Elastic IPs, VPC peering connections
+      and route tables of one or more VPCs, and optionally the route tables of a peer VPC.
+    - All describe calls are independent and run concurrently, using a single pooled EC2 client.
+    - NAT gateways in C(deleting) or C(deleted) state are not returned.
+version_added: "2.2"
+options:
+  region:
+    description:
+      - The AWS region to use.
+    required: true
+    aliases: ['aws_region', 'ec2_region']
+  vpc_id:
+    description:
+      - VPC to gather facts for. Mutually exclusive with C(vpc_ids).
+    required: false
+  vpc_ids:
+    description:
+      - List of VPCs to gather facts for. An empty list returns empty facts.
+    required: false
+  peer_vpc_id:
+    description:
+      - Only return peering connections accepted by this VPC.
+    required: false
+  peer_route_table_tags:
+    description:
+      - Tags of route tables to return as C(peer_route_tables) (e.g. bastion VPC route tables).
+    required: false
+  workers:
+    description:
+      - Number of concurrent describe calls.
+    required: false
+    default: 6
+requirements:
+  - boto3
+'''
+
+EXAMPLES = '''
+# Note: These examples do not set authentication details, see the AWS Guide for details.
+
+# Network facts of gaia VPC and route tables of the bastion VPC
+- ec2_vpc_network_facts:
+    region: us-east-1
+    vpc_id: vpc-123456
+    peer_vpc_id: vpc-654321
+    peer_route_table_tags:
+      Name: bastion-rt
+      env: develop
+  register: _network
+'''
+
+RETURN = '''
+network:
+    description: Network facts
+    returned: always
+    type: dict
+    sample: {
+        "vpc_ids": ["vpc-123456"],
+        "subnets": {"public": [{"id": "subnet-1a2b3c4d", "vpc_id": "vpc-123456", "cidr_block": "10.10.0.0/24",
+                                "availability_zone": "us-east-1a", "tags": {"tier": "public"}}]},
+        "nat_gateways": [{"id": "nat-0a1b2c3d", "subnet_id": "subnet-1a2b3c4d", "vpc_id": "vpc-123456",
+                          "state": "available", "network_interface_ids": ["eni-1a2b3c4d"],
+                          "allocation_ids": ["eipalloc-1a2b3c4d"], "public_ips": ["52.1.2.3"]}],
+        "eips": [{"allocation_id": "eipalloc-1a2b3c4d", "public_ip": "52.1.2.3", "association_id": "eipassoc-1a2b3c4d",
+                  "network_interface_id": "eni-1a2b3c4d"}],
+        "peering_connections": [{"id": "pcx-1a2b3c4d", "status": "active",
+                                 "requester_vpc_id": "vpc-123456", "accepter_vpc_id": "vpc-654321"}],
+        "route_tables": [{"id": "rtb-1a2b3c4d", "vpc_id": "vpc-123456", "tags": {}, "subnet_ids": [],
+                          "routes": [{"destination_cidr_block": "0.0.0.0/0", "gateway_id": "igw-1a2b3c4d"}]}],
+        "peer_route_tables": []
+    }
+'''
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    import botocore
+    import botocore.config
+    import boto3
+    HAS_BOTO3 = True
+except ImportError:
+    HAS_BOTO3 = False
+
+NAT_GATEWAY_STATES = ['pending', 'available', 'failed']
+
+
+def tags_dict(tags):
+    return dict((tag['Key'], tag['Value']) for tag in tags or [])
+
+def paginate(client, operation, key, **kwargs):
+    items = []
+    for response in client.get_paginator(operation).paginate(**kwargs):
+        items.extend(response[key])
+    return items
+
+def get_subnets(client, vpc_ids):
+    subnets = {}
+    if not vpc_ids:
+        return subnets
+    for subnet in paginate(client, 'describe_subnets', 'Subnets', Filters=[{'Name': 'vpc-id', 'Values': vpc_ids}]):
+        tags = tags_dict(subnet.get('Tags'))
+        subnets.setdefault(tags.get('tier', ''), []).append({
+            'id': subnet['SubnetId'],
+            'vpc_id': subnet['VpcId'],
+            'cidr_block': subnet['CidrBlock'],
+            'availability_zone': subnet['AvailabilityZone'],
+            'tags': tags,
+        })
+    return subnets
+
+def get_nat_gateways(client, vpc_ids):
+    if not vpc_ids:
+        return []
+    # describe_nat_gateways has no paginator in older botocore
+    nat_gateways = []
+    kwargs = {'Filters': [{'Name': 'vpc-id', 'Values': vpc_ids},
+                          {'Name': 'state', 'Values': NAT_GATEWAY_STATES}]}
+    while True:
+        response = client.describe_nat_gateways(**kwargs)
+        for gateway in response['NatGateways']:
+            addresses = gateway.get('NatGatewayAddresses', [])
+            nat_gateways.append({
+                'id': gateway['NatGatewayId'],
+                'subnet_id': gateway['SubnetId'],
+                'vpc_id': gateway['VpcId'],
+                'state': gateway['State'],
+                'network_interface_ids': [a['NetworkInterfaceId'] for a in addresses if 'NetworkInterfaceId' in a],
+                'allocation_ids': [a['AllocationId'] for a in addresses if 'AllocationId' in a],
+                'public_ips': [a['PublicIp'] for a in addresses if 'PublicIp' in a],
+            })
+        if not response.get('NextToken'):
+            return nat_gateways
+        kwargs['NextToken'] = response['NextToken']
+
+def get_eips(client):
+    return [{
+        'allocation_id': address.get('AllocationId'),
+        'public_ip': address['PublicIp'],
+        'association_id': address.get('AssociationId'),
+        'network_interface_id': address.get('NetworkInterfaceId'),
+    } for address in client.describe_addresses(Filters=[{'Name': 'domain', 'Values': ['vpc']}])['Addresses']]
+
+def get_peering_connections(client, vpc_ids, peer_vpc_id):
+    if not vpc_ids:
+        return []
+    filters = [{'Name': 'requester-vpc-info.vpc-id', 'Values': vpc_ids}]
+    if peer_vpc_id:
+        filters.append({'Name': 'accepter-vpc-info.vpc-id', 'Values': [peer_vpc_id]})
+    return [{
+        'id': peering['VpcPeeringConnectionId'],
+        'status': peering['Status']['Code'],
+        'requester_vpc_id': peering['RequesterVpcInfo'].get('VpcId'),
+        'accepter_vpc_id': peering['AccepterVpcInfo'].get('VpcId'),
+    } for peering in client.describe_vpc_peering_connections(Filters=filters)['VpcPeeringConnections']]
+
+def get_route_tables(client, filters):
+    route_tables = []
+    for route_table in client.describe_route_tables(Filters=filters)['RouteTables']:
+        route_tables.append({
+            'id': route_table['RouteTableId'],
+            'vpc_id': route_table['VpcId'],
+            'tags': tags_dict(route_table.get('Tags')),
+            'subnet_ids': [a['SubnetId'] for a in route_table.get('Associations', []) if 'SubnetId' in a],
+            'routes': [camel_dict_to_snake_dict(route) for route in route_table.get('Routes', [])],
+        })
+    return route_tables
+
+def gather_facts(client, module, vpc_ids):
+    peer_vpc_id = module.params.get('peer_vpc_id')
+    peer_tags = module.params.get('peer_route_table_tags')
+
+    calls = {
+        'subnets': lambda: get_subnets(client, vpc_ids),
+        'nat_gateways': lambda: get_nat_gateways(client, vpc_ids),
+        'eips': lambda: get_eips(client) if vpc_ids else [],
+        'peering_connections': lambda: get_peering_connections(client, vpc_ids, peer_vpc_id),
+        'route_tables': lambda: get_route_tables(client, [{'Name': 'vpc-id', 'Values': vpc_ids}]) if vpc_ids else [],
+        'peer_route_tables': lambda: get_route_tables(client, [{'Name': 'tag:' + k, 'Values': [v]}
+                                                              for k, v in peer_tags.items()]) if peer_tags else [],
+    }
+
+    def run(name):
+        try:
+            return name, calls[name](), None
+        except botocore.exceptions.ClientError as e:
+            return name, None, str(e)
+
+    pool = ThreadPool(max(1, min(module.params.get('workers'), len(calls))))
+    try:
+        results = pool.map(run, sorted(calls))
+    finally:
+        pool.close()
+        pool.join()
+
+    errors = ['%s: %s' % (name, error) for name, result, error in results if error]
+    if errors:
+        module.fail_json(msg="Boto3 Client Error - " + '; '.join(errors))
+
+    network = dict((name, result) for name, result, error in results)
+    network['vpc_ids'] = vpc_ids
+    # only Elastic IPs of the NAT gateways belong to the VPC
+    nat_allocation_ids = set(a for gateway in network['nat_gateways'] for a in gateway['allocation_ids'])
+    network['eips'] = [eip for eip in network['eips'] if eip['allocation_id'] in nat_allocation_ids]
+    return network
+
+
+def main():
+    argument_spec = ec2_argument_spec()
+    argument_spec.update(
+        dict(
+            region=dict(required=True, aliases=['aws_region', 'ec2_region']),
+            vpc_id=dict(required=False),
+            vpc_ids=dict(type='list', required=False),
+            peer_vpc_id=dict(required=False),
+            peer_route_table_tags=dict(type='dict', required=False),
+            workers=dict(type='int', default=6),
+        )
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec,
+                           mutually_exclusive=[['vpc_id', 'vpc_ids']],
+                           required_one_of=[['vpc_id', 'vpc_ids']],
+                           supports_check_mode=True)
+
+    # Validate Requirements
+    if not HAS_BOTO3:
+        module.fail_json(msg='botocore/boto3 is required.')
+
+    region, ec2_url, aws_connect_params = get_aws_connection_info(module, True)
+
+    if region:
+        try:
+            # share one connection pool between worker threads
+            config = client_config(max_pool_connections=module.params.get('workers'))
+            client = instrument_client(boto3_conn(module=module, conn_type='client', resource='ec2', region=region,
+                                                  config=config, **aws_connect_params))
+        except botocore.exceptions.ClientError as e:
+            module.fail_json(msg="Boto3 Client Error - " + str(e))
+    else:
+        module.fail_json(msg="region must be specified")
+
+    vpc_ids = [module.params['vpc_id']] if module.params.get('vpc_id') else module.params.get('vpc_ids')
+    network = gather_facts(client, module, [vpc_id for vpc_id in vpc_ids if vpc_id])
+
+    module.exit_json(changed=False, network=network, aws_api_calls=aws_api_calls())
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.ec2 import *
+from ansible.module_utils.gaia_aws import client_config, instrument_client, aws_api_calls
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This Ansible library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+DOCUMENTATION = '''
+---
+module: route53_batch
+short_description: Upsert a set of Route53 records in a single change batch
+description:
+    - Compares desired record sets with the current content of a hosted zone
+      and submits all differences as one ChangeResourceRecordSets call.
+    - Nothing is submitted when the zone is already up to date.
+version_added: "2.2"
+options:
+  zone:
+    description:
+      - The DNS zone name (e.g. C(gaia-dev.us-east-1.priv)).
+    required: true
+  private_zone:
+    description:
+      - Look up a private hosted zone.
+    required: false
+    default: false
+  records:
+    description:
+      - List of desired record sets, each a dict with C(record), C(type), C(ttl) and C(values) keys.
+    required: true
+  wait:
+    description:
+      - Wait until the change is propagated to all Route53 DNS servers.
+    required: false
+    default: false
+requirements:
+  - boto3
+'''
+
+EXAMPLES = '''
+# Note: These examples do not set authentication details, see the AWS Guide for details.
+
+# Register etcd A and SRV records (see etcd_dns_records filter)
+- route53_batch:
+    zone: "{{ vpc_dns_zone }}"
+    private_zone: true
+    records: "{{ etcd_ips | etcd_dns_records(vpc_dns_zone) }}"
+'''
+
+RETURN = '''
+changes:
+    description: Names and types of record sets that were upserted
+    returned: always
+    type: list
+    sample: ["etcd-0.gaia-dev.us-east-1.priv. A"]
+change_id:
+    description: Route53 change id
+    returned: when changed
+    type: string
+    sample: "/change/C2682N5HXP0BZ4"
+'''
+
+try:
+    import botocore
+    import boto3
+    HAS_BOTO3 = True
+except ImportError:
+    HAS_BOTO3 = False
+
+def normalize_name(name):
+    name = name.lower()
+    if not name.endswith('.'):
+        name += '.'
+    return name
+
+def get_hosted_zone_id(client, module):
+    zone = normalize_name(module.params.get('zone'))
+    private_zone = module.params.get('private_zone')
+
+    paginator = client.get_paginator('list_hosted_zones')
+    for response in paginator.paginate():
+        for hosted_zone in response['HostedZones']:
+            if hosted_zone['Name'] == zone and hosted_zone['Config'].get('PrivateZone', False) == private_zone:
+                return hosted_zone['Id']
+
+    module.fail_json(msg="Hosted zone '%s' was not found" % zone)
+
+def get_current_records(client, zone_id):
+    current = {}
+    paginator = client.get_paginator('list_resource_record_sets')
+    for response in paginator.paginate(HostedZoneId=zone_id):
+        for record_set in response['ResourceRecordSets']:
+            # alias records have no TTL/values and are never managed here
+            if 'AliasTarget' in record_set:
+                continue
+            values = sorted(r['Value'] for r in record_set.get('ResourceRecords', []))
+            current[(normalize_name(record_set['Name']), record_set['Type'])] = (record_set.get('TTL'), values)
+
+    return current
+
+def get_changes(desired, current):
+    changes = []
+    for record in desired:
+        name = normalize_name(record['record'])
+        values = sorted(record['values'])
+        ttl = int(record['ttl'])
+        if current.get((name, record['type'])) == (ttl, values):
+            continue
+        changes.append({
+            'Action': 'UPSERT',
+            'ResourceRecordSet': {
+                'Name': name,
+                'Type': record['type'],
+                'TTL': ttl,
+                'ResourceRecords': [{'Value': value} for value in values],
+            }
+        })
+
+    return changes
+
+def update_records(client, module):
+    try:
+        zone_id = get_hosted_zone_id(client, module)
+        changes = get_changes(module.params.get('records'), get_current_records(client, zone_id))
+        names = ['%s %s' % (c['ResourceRecordSet']['Name'], c['ResourceRecordSet']['Type']) for c in changes]
+
+        if not changes:
+            module.exit_json(changed=False, changes=names, aws_api_calls=aws_api_calls())
+        if module.check_mode:
+            module.exit_json(changed=True, changes=names, aws_api_calls=aws_api_calls())
+
+        response = client.change_resource_record_sets(HostedZoneId=zone_id,
+                                                      ChangeBatch={'Changes': changes})
+        change_id = response['ChangeInfo']['Id']
+        if module.params.get('wait'):
+            client.get_waiter('resource_record_sets_changed').wait(Id=change_id)
+    except botocore.exceptions.ClientError as e:
+        module.fail_json(msg="Boto3 Client Error - " + str(e))
+
+    module.exit_json(changed=True, changes=names, change_id=change_id, aws_api_calls=aws_api_calls())
+
+
+def main():
+    argument_spec = ec2_argument_spec()
+    argument_spec.update(
+        dict(
+            zone=dict(required=True),
+            private_zone=dict(type='bool', default=False),
+            records=dict(type='list', required=True),
+            wait=dict(type='bool', default=False),
+        )
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=True)
+
+    # Validate Requirements
+    if not HAS_BOTO3:
+        module.fail_json(msg='botocore/boto3 is required.')
+
+    region, ec2_url, aws_connect_params = get_aws_connection_info(module, True)
+
+    try:
+        client = instrument_client(boto3_conn(module=module, conn_type='client', resource='route53', region=region, config=client_config(), **aws_connect_params))
+    except botocore.exceptions.ClientError as e:
+        module.fail_json(msg="Boto3 Client Error - " + str(e))
+
+    update_records(client, module)
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.ec2 import *
+from ansible.module_utils.gaia_aws import client_config, instrument_client, aws_api_calls
+
+if __name__ == '__main__':
+    main()
@@ -5,21 +5,28 @@ start=$(date +%s)
 
 # read input parameters
 vflag=""
+pflag=""
 while [ $# -gt 0 ]
 do
   case "$1" in
     -v) vflag="-vvvv";;
+    -p) pflag="yes";;
     -d) dns="$2"; shift;;
     -e) env="$2"; shift;;
     -h)
-        echo >&2 "usage: $0 -e environment -d dns -v"
+        echo >&2 "usage: $0 -e environment -d dns -v -p"
         exit 1;;
      *) break;; # terminate while loop
   esac
   shift
 done
 
-ansible-playbook --extra-vars "environ=$env dns=$dns" main.yaml --tags=install $vflag
+if [ -n "$pflag" ]; then
+  # run independent stages in parallel (see pipeline.py)
+  python pipeline.py -e "$env" -d "$dns" ${vflag:+-v}
+else
+  ansible-playbook --extra-vars "environ=$env dns=$dns" main.yaml --tags=install $vflag
+fi
 
 end=$(date +%s)
 duration=$(( $end - $start ))
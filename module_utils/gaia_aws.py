@@ -0,0 +1,263 @@
+# Shared helpers for gaia AWS modules (see library/)
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This Ansible library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+import re
+import threading
+from time import sleep, time
+
+# error codes AWS services return when a request exceeds the API rate limit
+THROTTLING_ERRORS = frozenset([
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled', 'RequestThrottledException',
+    'RequestLimitExceeded', 'TooManyRequestsException', 'PriorRequestNotComplete', 'SlowDown',
+])
+
+# server side errors and connection failures botocore would retry
+TRANSIENT_ERRORS = frozenset(['InternalError', 'InternalFailure', 'ServiceUnavailable', 'Unavailable', 'RequestTimeout'])
+TRANSIENT_EXCEPTIONS = frozenset(['EndpointConnectionError', 'ConnectionClosedError', 'ConnectTimeoutError',
+                                  'ReadTimeoutError'])
+
+# (refill rate per second, burst) of the token bucket of a (service, region);
+# EC2 allows bursts of 100 describe calls refilled at 20/s, Route 53 5 calls/s per account
+DEFAULT_RATE = (float(os.environ.get('GAIA_AWS_RATE', 20)), float(os.environ.get('GAIA_AWS_BURST', 100)))
+SERVICE_RATES = {
+    'route53': (5.0, 5.0),
+}
+MAX_CONCURRENCY = int(os.environ.get('GAIA_AWS_CONCURRENCY', 32))
+MAX_RETRIES = int(os.environ.get('GAIA_AWS_MAX_RETRIES', 8))
+
+# error code in an XML or JSON error response of boto (2)
+ERROR_CODE_RE = re.compile(r'<Code>(\w+)</Code>|"Code"\s*:\s*"(\w+)"')
+
+
+class ApiCallStats(object):
+    ''' Count and time AWS API calls per service and operation, through botocore events '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def instrument(self, client):
+        ''' Register event hooks on a boto3 client, return the client '''
+        events = client.meta.events
+        events.register('before-call.*.*', self._before_call)
+        events.register('after-call.*.*', self._after_call)
+        events.register('after-call-error.*.*', self._after_call)
+        return client
+
+    def _before_call(self, model, context=None, **kwargs):
+        if context is not None:
+            context['gaia_call_start'] = time()
+
+    def _after_call(self, model, context=None, **kwargs):
+        start = (context or {}).get('gaia_call_start')
+        elapsed = time() - start if start else 0.0
+        service = model.service_model.service_name
+        with self.lock:
+            stats = self.calls.setdefault(service, {'count': 0, 'seconds': 0.0, 'operations': {}})
+            stats['count'] += 1
+            stats['seconds'] += elapsed
+            stats['operations'][model.name] = stats['operations'].get(model.name, 0) + 1
+
+    def summary(self):
+        ''' JSON friendly {service: {count, seconds, operations}} to return from module '''
+        with self.lock:
+            return dict((service, {'count': stats['count'],
+                                   'seconds': round(stats['seconds'], 3),
+                                   'operations': dict(stats['operations'])})
+                        for service, stats in self.calls.items())
+
+
+def error_code(error):
+    ''' Error code of a botocore ClientError or a boto BotoServerError '''
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return getattr(error, 'error_code', None)
+
+def is_transient(error):
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict) and response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500:
+        return True
+    return error_code(error) in TRANSIENT_ERRORS or \
+        any(cls.__name__ in TRANSIENT_EXCEPTIONS for cls in type(error).__mro__)
+
+
+class TokenBucket(object):
+    ''' Request rate and concurrency limit of one (service, region).
+
+    Calls take a token; tokens refill at rate per second up to burst. The number
+    of calls in flight follows AIMD: it grows by one per window of successful
+    calls and is halved when a call is throttled.
+    '''
+
+    def __init__(self, rate, burst, concurrency):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time()
+        self.max_concurrency = concurrency
+        self.concurrency = float(concurrency)
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                now = time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.in_flight >= int(self.concurrency):
+                    # woken up by release()
+                    self.cond.wait()
+                elif self.tokens < 1:
+                    self.cond.wait((1 - self.tokens) / self.rate)
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+
+    def release(self, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.concurrency = max(1.0, self.concurrency / 2)
+                # let the service recover before the next call
+                self.tokens = min(self.tokens, 0.0)
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self.cond.notify_all()
+
+
+class RateLimiter(object):
+    ''' Run AWS calls through a token bucket per (service, region), retry throttled
+    and transient failures with jittered exponential backoff and count retries '''
+
+    def __init__(self, max_retries=MAX_RETRIES, base_delay=0.2, max_delay=20.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.retries = {}
+
+    def bucket(self, service, region):
+        with self.lock:
+            key = (service, region)
+            if key not in self.buckets:
+                rate, burst = SERVICE_RATES.get(service, DEFAULT_RATE)
+                self.buckets[key] = TokenBucket(rate, burst, MAX_CONCURRENCY)
+            return self.buckets[key]
+
+    def backoff(self, attempt):
+        # "full jitter": spread retries of concurrent callers over the whole interval
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, service, region, operation, func, throttled_result=None):
+        ''' Return func(), retrying while it raises a throttling or transient error,
+        or while throttled_result(result) is true (for clients that return errors) '''
+        bucket = self.bucket(service, region)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            try:
+                result = func()
+            except Exception as e:
+                throttled = error_code(e) in THROTTLING_ERRORS
+                bucket.release(throttled)
+                if attempt >= self.max_retries or not (throttled or is_transient(e)):
+                    raise
+            else:
+                throttled = throttled_result is not None and throttled_result(result)
+                bucket.release(throttled)
+                if attempt >= self.max_retries or not throttled:
+                    return result
+            self._count(service, operation, throttled)
+            sleep(self.backoff(attempt))
+            attempt += 1
+
+    def _count(self, service, operation, throttled):
+        with self.lock:
+            stats = self.retries.setdefault(service, {'retries': 0, 'throttled': 0, 'operations': {}})
+            stats['retries'] += 1
+            stats['throttled'] += int(throttled)
+            stats['operations'][operation] = stats['operations'].get(operation, 0) + 1
+
+    def summary(self):
+        ''' {service: {retries, throttled, operations}} '''
+        with self.lock:
+            return dict((service, dict(stats, operations=dict(stats['operations'])))
+                        for service, stats in self.retries.items())
+
+
+# shared by all clients of a process, so that concurrent workers share the API budget
+RATE_LIMITER = RateLimiter()
+
+def client_config(**kwargs):
+    ''' botocore client Config for clients passed to limit_client: retries are done
+    by the limiter, botocore makes a single attempt in every retry mode '''
+    import botocore.config
+    return botocore.config.Config(retries={'max_attempts': 0}, **kwargs)
+
+def limit_client(client, limiter=RATE_LIMITER):
+    ''' Send all calls of a boto3 client, including paginators and waiters, through
+    limiter. Create the client with config=client_config(), or botocore retries too. '''
+    meta = client.meta
+    service = meta.service_model.service_name
+    make_api_call = client._make_api_call
+
+    def limited_make_api_call(operation_name, api_params):
+        return limiter.call(service, meta.region_name, operation_name,
+                            lambda: make_api_call(operation_name, api_params))
+
+    client._make_api_call = limited_make_api_call
+    return client
+
+def limit_boto_connection(conn, service, region, limiter=RATE_LIMITER):
+    ''' Send make_request of a boto (2) connection through limiter. boto returns
+    throttling errors as a response, the error code is looked up in its body. '''
+    make_request = conn.make_request
+
+    def throttled(response):
+        if response.status not in (400, 503):
+            return False
+        # boto caches the body, the caller can read it again
+        body = response.read() or ''
+        if not isinstance(body, str):
+            body = body.decode('utf-8', 'replace')
+        return any(code in THROTTLING_ERRORS for match in ERROR_CODE_RE.findall(body) for code in match)
+
+    def limited_make_request(*args, **kwargs):
+        operation = str(args[0]) if args else kwargs.get('action', '')
+        return limiter.call(service, region, operation, lambda: make_request(*args, **kwargs), throttled)
+
+    conn.make_request = limited_make_request
+    return conn
+
+
+# module wide statistics, returned as "aws_api_calls" and collected by profile_stages callback
+API_CALL_STATS = ApiCallStats()
+
+def instrument_client(client):
+    return API_CALL_STATS.instrument(limit_client(client))
+
+def aws_api_calls():
+    calls = API_CALL_STATS.summary()
+    for service, retries in RATE_LIMITER.summary().items():
+        stats = calls.setdefault(service, {'count': 0, 'seconds': 0.0, 'operations': {}})
+        stats['retries'] = retries['retries']
+        stats['throttled'] = retries['throttled']
+    return calls
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+'''
+Dependency-aware parallel runner for the main.yaml provisioning pipeline.
+
+main.yaml runs every role in series. Here the same roles are grouped into
+stages with explicit dependencies; every stage is run as a separate
+ansible-playbook shard as soon as all stages it depends on are done, so
+independent stages (e.g. s3, rds, elb, elasticsearch and rabbitmq clusters)
+run concurrently.
+
+Facts produced by set_fact do not cross ansible-playbook processes, so each
+shard first runs the read-only fact collecting roles it needs; resources are
+created only by their own stage.
+
+    ./pipeline.py -e develop -d mydns
+    ./pipeline.py -e develop -d mydns -j 4 --dry-run
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+from time import time
+
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+SHARD_PREFIX = '.pipeline-'
+LOG_DIR = '.pipeline-logs'
+
+VARS_FILES = ['keys/credentials.yaml', 'group_vars/elb.yaml', 'group_vars/vpc.yaml']
+
+# fact collecting roles re-run by shards that need their facts
+FACTS = {
+    'certs': [
+        {'role': 'gpg_keyrings', 'tags': ['install']},
+        {'role': 'https_certs', 'tags': ['install']},
+    ],
+    'acm': [
+        {'role': 'acm', 'tags': ['install']},
+    ],
+    'vpc': [
+        {'role': 'vpc_facts', 'tags': ['install']},
+        {'role': 'vpc_subnet_facts', 'tags': ['install']},
+    ],
+    'rds': [
+        {'role': 'rds_facts', 'tags': ['install']},
+    ],
+    'ami': [
+        {'role': 'find_coreos_ami', 'tags': ['install']},
+    ],
+}
+
+# stage name -> roles (as in main.yaml), facts needed, stages it depends on
+# and extra vars_files (role defaults used by role parameters outside that role)
+STAGES = {
+    'keys': {
+        'roles': [
+            {'role': 'keygen', 'keypair_region': '{{ ec2_region }}', 'keypair_name': '{{ etcd_keypair_name }}',
+             'keypair_file': '{{ etcd_keypair_file }}', 'tags': ['install']},
+            {'role': 'keygen', 'keypair_region': '{{ ec2_region }}', 'keypair_name': '{{ coreos_keypair_name }}',
+             'keypair_file': '{{ coreos_keypair_file }}', 'tags': ['install']},
+            {'role': 'gpg_keyrings', 'tags': ['install']},
+        ],
+    },
+    'vpc': {
+        'roles': [
+            {'role': 'vpc_facts', 'tags': ['install']},
+            {'role': 'vpc'},
+        ],
+    },
+    'network': {
+        'facts': ['vpc'],
+        'roles': [{'role': 'network'}],
+        'after': ['vpc'],
+    },
+    'elb': {
+        'facts': ['acm', 'vpc'],
+        'roles': [{'role': 'elb'}],
+        'after': ['vpc'],
+    },
+    's3': {
+        'roles': [{'role': 's3'}],
+    },
+    'rds': {
+        'facts': ['vpc'],
+        'roles': [{'role': 'rds'}],
+        'after': ['vpc'],
+    },
+    'etcd': {
+        'facts': ['certs', 'vpc', 'ami'],
+        'roles': [{'role': 'cluster', 'cluster_type': 'etcd'}, {'role': 'register_etcd'}],
+        'after': ['keys', 'network'],
+    },
+    'coreos': {
+        'facts': ['certs', 'vpc', 'rds', 'ami'],
+        'roles': [{'role': 'cluster', 'cluster_type': 'coreos'}],
+        'after': ['etcd', 'elb', 'rds'],
+    },
+    'elasticsearch': {
+        'facts': ['certs', 'vpc', 'ami'],
+        'roles': [{'role': 'cluster', 'cluster_type': 'elasticsearch'}],
+        'after': ['etcd'],
+    },
+    'rabbitmq': {
+        'facts': ['certs', 'vpc', 'ami'],
+        'roles': [{'role': 'cluster', 'cluster_type': 'rabbitmq'}],
+        'after': ['etcd'],
+    },
+    'volumes': {
+        'roles': [
+            {'role': 'volume', 'volume': '{{ es_volume }}',
+             'number_of_volumes': '{{ cluster_size_desired_capacity.elasticsearch }}'},
+            {'role': 'volume', 'volume': '{{ rabbitmq_volume }}',
+             'number_of_volumes': '{{ cluster_size_desired_capacity.rabbitmq }}'},
+            {'role': 'volume', 'volume': '{{ result_upload_volume }}'},
+        ],
+        'vars_files': ['roles/cluster/defaults/main.yaml'],
+    },
+}
+
+
+def check_graph(stages):
+    ''' Fail on unknown dependencies or cycles, return stages in topological order '''
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError('dependency cycle: %s' % ' -> '.join(path + [name]))
+        if name not in stages:
+            raise ValueError('unknown stage: %s' % name)
+        state[name] = 'visiting'
+        for dep in stages[name].get('after', []):
+            visit(dep, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for name in sorted(stages):
+        visit(name, [])
+    return order
+
+
+def shard_playbook(name, stage):
+    roles = []
+    for facts in stage.get('facts', []):
+        roles.extend(FACTS[facts])
+    roles.extend(stage['roles'])
+    play = {
+        'hosts': 'localhost',
+        'connection': 'local',
+        'gather_facts': False,
+        'vars_files': VARS_FILES + stage.get('vars_files', []),
+        'roles': roles,
+    }
+    # JSON is valid YAML
+    path = os.path.join(BASE_DIR, SHARD_PREFIX + name + '.yaml')
+    with open(path, 'w') as f:
+        json.dump([play], f, indent=2)
+    return path
+
+
+def critical_path(stages, durations):
+    ''' Longest chain of dependent stages by measured duration '''
+    best = {}
+    for name in check_graph(stages):
+        if name not in durations:
+            continue
+        deps = [best[d] for d in stages[name].get('after', []) if d in best]
+        prev = max(deps, key=lambda p: p[0]) if deps else (0.0, [])
+        best[name] = (prev[0] + durations[name], prev[1] + [name])
+    return max(best.values(), key=lambda p: p[0]) if best else (0.0, [])
+
+
+class Pipeline(object):
+
+    def __init__(self, stages, extra_vars, jobs, verbose=False):
+        self.stages = stages
+        self.extra_vars = extra_vars
+        self.jobs = jobs
+        self.verbose = verbose
+        self.cond = threading.Condition()
+        self.status = dict((name, 'pending') for name in stages)
+        self.durations = {}
+        self.running = 0
+
+    def run_stage(self, name):
+        playbook = shard_playbook(name, self.stages[name])
+        cmd = ['ansible-playbook', '--extra-vars', self.extra_vars, playbook, '--tags=install']
+        if self.verbose:
+            cmd.append('-vvvv')
+        # keep profile_stages callback output per stage
+        env = dict(os.environ, PROFILE_STAGES_OUTPUT=os.path.join(LOG_DIR, name + '.profile.json'))
+        start = time()
+        with open(os.path.join(BASE_DIR, LOG_DIR, name + '.log'), 'w') as log:
+            rc = subprocess.call(cmd, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        with self.cond:
+            self.durations[name] = time() - start
+            self.status[name] = 'ok' if rc == 0 else 'failed'
+            self.running -= 1
+            print('[%s] %s in %.0f seconds' % (name, self.status[name], self.durations[name]))
+            sys.stdout.flush()
+            self.cond.notify_all()
+
+    def ready(self, name):
+        return (self.status[name] == 'pending' and
+                all(self.status[dep] == 'ok' for dep in self.stages[name].get('after', [])))
+
+    def blocked(self, name):
+        return any(self.status[dep] in ('failed', 'skipped') for dep in self.stages[name].get('after', []))
+
+    def run(self):
+        if not os.path.isdir(os.path.join(BASE_DIR, LOG_DIR)):
+            os.makedirs(os.path.join(BASE_DIR, LOG_DIR))
+        order = check_graph(self.stages)
+        with self.cond:
+            while True:
+                for name in order:
+                    if self.status[name] == 'pending' and self.blocked(name):
+                        self.status[name] = 'skipped'
+                for name in order:
+                    if self.running >= self.jobs:
+                        break
+                    if self.ready(name):
+                        self.status[name] = 'running'
+                        self.running += 1
+                        print('[%s] started' % name)
+                        sys.stdout.flush()
+                        thread = threading.Thread(target=self.run_stage, args=(name,))
+                        thread.daemon = True
+                        thread.start()
+                if self.running == 0 and not any(self.ready(name) for name in order):
+                    break
+                self.cond.wait(1)
+        return all(status == 'ok' for status in self.status.values())
+
+    def report(self, total):
+        print('')
+        for name in sorted(self.durations, key=self.durations.get, reverse=True):
+            print('%-16s %-8s %6.0fs' % (name, self.status[name], self.durations[name]))
+        for name in sorted(self.status):
+            if self.status[name] == 'skipped':
+                print('%-16s %-8s' % (name, 'skipped'))
+        length, path = critical_path(self.stages, self.durations)
+        print('Critical path: %s (%.0f seconds)' % (' -> '.join(path), length))
+        total = int(total)
+        print('Duration: %d seconds (%d minutes and %d seconds)' % (total, total // 60, total % 60))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run main.yaml provisioning stages in parallel')
+    parser.add_argument('-e', dest='environ', required=True, help='environment: production|develop|custom')
+    parser.add_argument('-d', dest='dns', required=True, help='subdomain name for the environment')
+    parser.add_argument('-j', '--jobs', type=int, default=len(STAGES),
+                        help='maximum number of stages to run at once (default: unlimited)')
+    parser.add_argument('-v', dest='verbose', action='store_true', default=False,
+                        help='run ansible-playbook with -vvvv')
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='print stage graph and generate shard playbooks only')
+    args = parser.parse_args()
+
+    os.environ.setdefault('EC2_INI_PATH', 'inventory/ec2.ini')
+    order = check_graph(STAGES)
+
+    if args.dry_run:
+        for name in order:
+            print('%-16s after: %-24s playbook: %s' % (name, ','.join(STAGES[name].get('after', [])) or '-',
+                                                       os.path.basename(shard_playbook(name, STAGES[name]))))
+        return
+
+    pipeline = Pipeline(STAGES, 'environ=%s dns=%s' % (args.environ, args.dns), args.jobs, args.verbose)
+    start = time()
+    success = pipeline.run()
+    pipeline.report(time() - start)
+    if not success:
+        print('Failed stages logs: %s/' % LOG_DIR)
+    sys.exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+'''
+Switch CoreOS update channel on all fleet machines.
+
+Runs channel switch steps as a single remote script per host over one
+multiplexed ssh connection (see ssh_config generated by ssh_config_amazon.yaml),
+in parallel across hosts.
+
+    ./switch_channel.py beta
+    ./switch_channel.py -c 8 -u 2 --ssh-config keys/us-east-1/ssh_config_dev stable
+'''
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+from time import time
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+SSH_CONFIG = 'keys/us-east-1/ssh_config_prod'
+FLEET_HOST = '10.10.3.55'
+CONTROL_PATH = '~/.ssh/mux-%r@%h:%p'
+
+SWITCH_SCRIPT = '''set -e
+sudo bash -c "echo GROUP={group} > /etc/coreos/update.conf"
+grep -qs ' /usr/share/coreos/release ' /proc/mounts || {{ cp /usr/share/coreos/release /tmp && sudo mount -o bind /tmp/release /usr/share/coreos/release; }}
+sed "s/COREOS_RELEASE_VERSION=.*/COREOS_RELEASE_VERSION=0.0.0/g" /usr/share/coreos/release > /tmp/0-release
+mv /tmp/0-release /tmp/release
+sudo systemctl restart update-engine
+update_engine_client -update
+'''
+
+
+def ssh_command(ssh_config, host, command, connect_timeout=None):
+    ''' ssh command line reusing (or creating) a multiplexed master connection '''
+    options = ['-o', 'ControlMaster=auto',
+               '-o', 'ControlPath=%s' % CONTROL_PATH,
+               '-o', 'ControlPersist=10m']
+    if connect_timeout:
+        options += ['-o', 'ConnectTimeout=%d' % connect_timeout]
+    return ['ssh', '-F', ssh_config] + options + [host, command]
+
+
+def run_remote(ssh_config, host, command, script=None, connect_timeout=None, timeout=None):
+    ''' Run command on host (feeding script to its stdin), return (rc, stdout, stderr, seconds).
+    With timeout, ssh is killed after timeout seconds and rc is 255, as for a failed connection. '''
+    start = time()
+    proc = subprocess.Popen(ssh_command(ssh_config, host, command, connect_timeout),
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    timer = threading.Timer(timeout, proc.kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        out, err = proc.communicate(script)
+    finally:
+        if timer:
+            timer.cancel()
+    if proc.returncode < 0:
+        return 255, out, 'ssh to %s timed out after %d seconds' % (host, timeout), time() - start
+    return proc.returncode, out, err, time() - start
+
+
+def list_machines(ssh_config, fleet_host):
+    rc, out, err, _ = run_remote(ssh_config, fleet_host, 'fleetctl list-machines --fields ip -no-legend')
+    if rc != 0:
+        raise RuntimeError('fleetctl list-machines failed on %s: %s' % (fleet_host, err.strip()))
+    return out.split()
+
+
+def switch_channel(machines, group, ssh_config, concurrency, max_unavailable):
+    ''' Switch all machines; stop starting new hosts once max_unavailable hosts failed '''
+    script = SWITCH_SCRIPT.format(group=quote(group))
+    lock = threading.Lock()
+    state = {'failed': 0}
+
+    def switch(host):
+        with lock:
+            if state['failed'] >= max_unavailable:
+                return {'host': host, 'status': 'skipped', 'seconds': 0.0}
+        rc, out, err, seconds = run_remote(ssh_config, host, 'bash -s', script)
+        result = {'host': host, 'status': 'ok' if rc == 0 else 'failed', 'rc': rc, 'seconds': round(seconds, 2)}
+        if rc != 0:
+            result['error'] = err.strip() or out.strip()
+            with lock:
+                state['failed'] += 1
+        return result
+
+    pool = ThreadPool(max(1, min(concurrency, len(machines))))
+    try:
+        return pool.map(switch, machines, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def print_report(results, total):
+    for r in sorted(results, key=lambda r: r['seconds'], reverse=True):
+        line = '%-16s %-8s %6.2fs' % (r['host'], r['status'], r['seconds'])
+        if 'error' in r:
+            line += '  ' + r['error'].splitlines()[-1]
+        print(line)
+    counts = dict((s, len([r for r in results if r['status'] == s])) for s in ('ok', 'failed', 'skipped'))
+    print('Duration: %.2f seconds (ok: %d, failed: %d, skipped: %d)' %
+          (total, counts['ok'], counts['failed'], counts['skipped']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Switch CoreOS update channel on all fleet machines')
+    parser.add_argument('group', help='CoreOS update channel (GROUP): alpha, beta, stable')
+    parser.add_argument('-F', '--ssh-config', default=SSH_CONFIG,
+                        help='ssh config to use (default: %s)' % SSH_CONFIG)
+    parser.add_argument('--fleet-host', default=FLEET_HOST,
+                        help='host to run "fleetctl list-machines" on (default: %s)' % FLEET_HOST)
+    parser.add_argument('-c', '--concurrency', type=int, default=4,
+                        help='number of hosts to switch in parallel (default: 4)')
+    parser.add_argument('-u', '--max-unavailable', type=int, default=1,
+                        help='stop starting new hosts after this many failures (default: 1)')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='print report as JSON')
+    args = parser.parse_args()
+
+    if not re.match(r'^[A-Za-z0-9_.-]+$', args.group):
+        parser.error('invalid channel name: %s' % args.group)
+
+    start = time()
+    machines = list_machines(args.ssh_config, args.fleet_host)
+    results = switch_channel(machines, args.group, args.ssh_config, args.concurrency, args.max_unavailable)
+    total = time() - start
+
+    if args.json:
+        print(json.dumps({'hosts': results, 'seconds': round(total, 2)}, sort_keys=True, indent=2))
+    else:
+        print_report(results, total)
+
+    sys.exit(0 if all(r['status'] == 'ok' for r in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
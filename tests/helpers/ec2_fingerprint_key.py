@@ -1,16 +1,17 @@
 #!/usr/bin/env python
+import base64
+import glob
 import hashlib
+import json
+import multiprocessing
 import optparse
+import os
+import sys
 
 import paramiko
 from Crypto.PublicKey import RSA
 
 
-def insert_char_every_n_chars(string, char='\n', every=64):
-    return char.join(
-        string[i:i + every] for i in xrange(0, len(string), every))
-
-
 def get_rsa_key(key_location=None, key_file_obj=None, passphrase=None,
                 use_pycrypto=False):
     key_fobj = key_file_obj or open(key_location)
@@ -27,6 +28,13 @@ def get_rsa_key(key_location=None, key_file_obj=None, passphrase=None,
             key_location)
 
 
+def colon_hex(hexdigest):
+    """
+    Returns hexdigest with a ':' between every 2 characters.
+    """
+    return ':'.join(a + b for a, b in zip(hexdigest[::2], hexdigest[1::2]))
+
+
 def get_public_key(key):
     return ' '.join([key.get_name(), key.get_base64()])
 
@@ -35,6 +43,73 @@ def generate_rsa_key():
     return paramiko.RSAKey.generate(2048)
 
 
+def private_rsa_fingerprint(key):
+    """
+    Returns the fingerprint of an imported (PyCrypto) private RSA key.
+    """
+    return colon_hex(hashlib.sha1(key.exportKey('DER', pkcs=8)).hexdigest())
+
+
+def public_rsa_fingerprint(key):
+    """
+    Returns the fingerprint of the public portion of an imported (PyCrypto)
+    RSA key.
+    """
+    return colon_hex(hashlib.md5(key.publickey().exportKey('DER')).hexdigest())
+
+
+def openssh_rsa_fingerprint(key):
+    """
+    Returns the OpenSSH (ssh-keygen -l) SHA256 fingerprint of an imported
+    (PyCrypto) RSA key.
+    """
+    blob = base64.b64decode(key.publickey().exportKey('OpenSSH').split()[1])
+    digest = base64.b64encode(hashlib.sha256(blob).digest()).decode('ascii')
+    return 'SHA256:' + digest.rstrip('=')
+
+
+def fingerprint_key(key_location=None, key_file_obj=None, passphrase=None):
+    """
+    Parses an RSA private key once and returns all of its fingerprints:
+    public MD5 (EC2 imported keys), private SHA1 (EC2 created keys) and
+    OpenSSH SHA256.
+    """
+    if key_file_obj is None:
+        with open(key_location, 'rb') as f:
+            data = f.read()
+    else:
+        data = key_file_obj.read()
+    try:
+        key = RSA.importKey(data, passphrase=passphrase)
+    except (ValueError, IndexError, TypeError):
+        raise Exception(
+            "Invalid RSA private key file or missing passphrase: %s" %
+            key_location)
+    return {
+        'path': key_location,
+        'public_md5': public_rsa_fingerprint(key),
+        'private_sha1': private_rsa_fingerprint(key),
+        'openssh_sha256': openssh_rsa_fingerprint(key),
+    }
+
+
+def iter_fingerprints(paths, passphrase=None):
+    """
+    Yields fingerprint_key() results for many key files; '-' reads a key
+    from stdin. Unreadable keys yield {'path': path, 'error': message}.
+    """
+    for path in paths:
+        try:
+            if path == '-':
+                result = fingerprint_key(key_location='<stdin>', key_file_obj=sys.stdin,
+                                         passphrase=passphrase)
+            else:
+                result = fingerprint_key(key_location=path, passphrase=passphrase)
+        except Exception as e:
+            result = {'path': path, 'error': str(e)}
+        yield result
+
+
 def get_private_rsa_fingerprint(key_location=None, key_file_obj=None,
                                 passphrase=None):
     """
@@ -45,8 +120,7 @@ def get_private_rsa_fingerprint(key_location=None, key_file_obj=None,
     """
     k = get_rsa_key(key_location=key_location, key_file_obj=key_file_obj,
                     passphrase=passphrase, use_pycrypto=True)
-    sha1digest = hashlib.sha1(k.exportKey('DER', pkcs=8)).hexdigest()
-    fingerprint = insert_char_every_n_chars(sha1digest, ':', 2)
+    fingerprint = private_rsa_fingerprint(k)
     print '>>> RSA Private Key Fingerprint:\n%s' % fingerprint
     return fingerprint
 
@@ -61,15 +135,110 @@ def get_public_rsa_fingerprint(key_location=None, key_file_obj=None,
     """
     privkey = get_rsa_key(key_location=key_location, key_file_obj=key_file_obj,
                           passphrase=passphrase, use_pycrypto=True)
-    pubkey = privkey.publickey()
-    md5digest = hashlib.md5(pubkey.exportKey('DER')).hexdigest()
-    fingerprint = insert_char_every_n_chars(md5digest, ':', 2)
+    fingerprint = public_rsa_fingerprint(privkey)
     print '>>> RSA Public Key Fingerprint:\n%s' % fingerprint
     return fingerprint
 
 
+FINGERPRINT_CACHE = os.path.expanduser('~/.ansible/tmp/ec2fingerprint.cache')
+
+
+def _file_key(path):
+    # content digest: a key rewritten within the same second keeps mtime and size
+    with open(path, 'rb') as f:
+        return '%s:%s' % (os.path.abspath(path), hashlib.sha1(f.read()).hexdigest())
+
+
+def _private_fingerprint_worker(path):
+    return fingerprint_key(key_location=path)['private_sha1']
+
+
+def fingerprint_keys(paths, processes=None, cache_file=FINGERPRINT_CACHE):
+    """
+    Returns {path: private key fingerprint} for many key files. Keys are
+    parsed in a process pool; results are memoized in cache_file, keyed by
+    file path and content digest, so unchanged keys are never parsed again.
+    """
+    cache = {}
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            with open(cache_file) as f:
+                cache = json.load(f)
+        except ValueError:
+            cache = {}
+
+    file_keys = dict((path, _file_key(path)) for path in paths)
+    missing = sorted(set(path for path in paths if file_keys[path] not in cache))
+    if missing:
+        if len(missing) == 1:
+            fingerprints = [_private_fingerprint_worker(missing[0])]
+        else:
+            pool = multiprocessing.Pool(processes or min(len(missing), multiprocessing.cpu_count()))
+            try:
+                fingerprints = pool.map(_private_fingerprint_worker, missing)
+            finally:
+                pool.close()
+                pool.join()
+        for path, fingerprint in zip(missing, fingerprints):
+            cache[file_keys[path]] = fingerprint
+        if cache_file:
+            cache_dir = os.path.dirname(cache_file)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            # drop entries of files that changed or no longer exist
+            current = set(file_keys.values())
+            for path in set(k.rsplit(':', 1)[0] for k in cache) - set(os.path.abspath(p) for p in file_keys):
+                if os.path.isfile(path):
+                    current.add(_file_key(path))
+            with open(cache_file, 'w') as f:
+                json.dump(dict((k, v) for k, v in cache.items() if k in current), f)
+
+    return dict((path, cache[file_keys[path]]) for path in paths)
+
+
+def keypair_name_from_file(path):
+    """
+    Returns EC2 keypair name for a key file: keys/<region>/coreos-key-dev.pem
+    -> coreos-keypair-dev
+    """
+    name = os.path.basename(path)
+    if name.endswith('.pem'):
+        name = name[:-len('.pem')]
+    return name.replace('-key-', '-keypair-', 1)
+
+
+def verify_key_pairs(ec2_client, key_files, processes=None):
+    """
+    Compares local key files with registered EC2 keypairs using a single
+    describe_key_pairs call. key_files is {keypair_name: path}; returns
+    {keypair_name: (ec2_fingerprint or None, local_fingerprint)}.
+    """
+    local = fingerprint_keys(list(key_files.values()), processes=processes)
+    response = ec2_client.describe_key_pairs(
+        Filters=[{'Name': 'key-name', 'Values': list(key_files.keys())}])
+    registered = dict((kp['KeyName'], kp['KeyFingerprint']) for kp in response['KeyPairs'])
+    return dict((name, (registered.get(name), local[path]))
+                for name, path in key_files.items())
+
+
+def verify_all_keys(keys_dir='keys', processes=None):
+    """
+    Verifies all *.pem files under keys/<region>/ against EC2 keypairs of
+    their region. Returns {region: {keypair_name: (ec2, local)}}.
+    """
+    import boto3
+    key_files = {}
+    for path in glob.glob(os.path.join(keys_dir, '*', '*.pem')):
+        region = os.path.basename(os.path.dirname(path))
+        key_files.setdefault(region, {})[keypair_name_from_file(path)] = path
+    # parse all keys in one pool, then one API call per region
+    fingerprint_keys([p for files in key_files.values() for p in files.values()], processes=processes)
+    return dict((region, verify_key_pairs(boto3.client('ec2', region_name=region), files, processes))
+                for region, files in key_files.items())
+
+
 def main():
-    usage = 'usage: ec2fingerprint [options] <rsakey>'
+    usage = 'usage: ec2fingerprint [options] <rsakey> [<rsakey> ...]'
     parser = optparse.OptionParser(usage=usage)
     parser.add_option("-p", "--public-only", dest="public_only",
                       action="store_true",
@@ -77,18 +246,48 @@ def main():
     parser.add_option("-P", "--private-only", dest="private_only",
                       action="store_true",
                       default=False)
+    parser.add_option("-a", "--verify-all", dest="verify_all",
+                      metavar="KEYS_DIR",
+                      help="verify all keys in KEYS_DIR/<region>/*.pem against EC2 keypairs")
+    parser.add_option("-j", "--json", dest="json",
+                      action="store_true", default=False,
+                      help="print all fingerprints of every key as JSON lines")
+    parser.add_option("-f", "--files-from", dest="files_from",
+                      metavar="FILE",
+                      help="read key file paths from FILE ('-' for stdin)")
     opts, args = parser.parse_args()
+    if opts.verify_all:
+        failed = False
+        results = verify_all_keys(opts.verify_all)
+        for region in sorted(results):
+            for name, (registered, local) in sorted(results[region].items()):
+                status = 'OK' if registered == local else ('MISSING' if registered is None else 'MISMATCH')
+                failed = failed or status != 'OK'
+                print('%-16s %-32s %s' % (region, name, status))
+        raise SystemExit(1 if failed else 0)
+    if opts.files_from:
+        f = sys.stdin if opts.files_from == '-' else open(opts.files_from)
+        args.extend(line.strip() for line in f if line.strip())
+    if opts.json or len(args) > 1:
+        failed = False
+        for result in iter_fingerprints(args):
+            failed = failed or 'error' in result
+            sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+        raise SystemExit(1 if failed else 0)
     if len(args) != 1:
-        parser.error("please specify a single RSA private key file")
+        parser.error("please specify an RSA private key file")
     path = args[0]
     if opts.public_only:
         get_public_rsa_fingerprint(key_location=path)
     elif opts.private_only:
         get_private_rsa_fingerprint(key_location=path)
     else:
-        get_public_rsa_fingerprint(key_location=path)
+        result = next(iter_fingerprints([path]))
+        if 'error' in result:
+            raise Exception(result['error'])
+        print '>>> RSA Public Key Fingerprint:\n%s' % result['public_md5']
         print
-        get_private_rsa_fingerprint(key_location=path)
+        print '>>> RSA Private Key Fingerprint:\n%s' % result['private_sha1']
 
 
 if __name__ == '__main__':